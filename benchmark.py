@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+###########################################################################
+### Benchmarks                                                          ###
+### Usage: benchmark.py -s small,medium -o results.json                 ###
+###        benchmark.py -c baseline.json -i results.json                ###
+###        benchmark.py -I                  (check import time budgets) ###
+###                                                                     ###
+### Times the CA engines in ca_viewer.py, parsing and PCA (get_pca.py) ###
+### and the MLP fit (nn_runner.py) on seeded synthetic inputs, so runs ###
+### on different versions can be compared. Nothing is plotted.          ###
+###                                                                     ###
+### Each benchmark is run once untimed (so lazy imports and first call ###
+### costs are not counted), timed repeats times (the best time is kept) ###
+### and then run once more under tracemalloc for its peak memory.       ###
+###########################################################################
+
+import sys, getopt, os, time, json, platform, tempfile, tracemalloc, warnings, subprocess
+os.environ.setdefault("MPLBACKEND", "Agg")                 #headless: never open a window
+import numpy as np
+
+#Rules/ICs for the CA benchmarks, and rows/columns of the MAG-like tables (136 = canonical tetranucleotides).
+SIZES = {
+    "small":  {"width": 149,  "gens": 320,  "rules": 20,  "ics": 100, "rows": 2000,   "cols": 136, "groups": 5, "reference": True},
+    "medium": {"width": 599,  "gens": 1000, "rules": 50,  "ics": 200, "rows": 20000,  "cols": 256, "groups": 8, "reference": True},
+    "large":  {"width": 2999, "gens": 3000, "rules": 100, "ics": 500, "rows": 100000, "cols": 256, "groups": 8, "reference": False},
+}
+BENCHMARKS = ["ca_reference", "ca_numpy", "ca_packed", "ca_batch", "table_parse", "pca", "mlp_fit"]
+
+#Seconds each script may take to import (numpy included), and the libraries importing it must not load: they are
+#only imported on the code paths that use them, so e.g. ca_viewer.py -h or get_pca.py --no-plot start quickly.
+IMPORT_BUDGETS = {"ca_viewer": 0.5, "ca_ga": 0.5, "get_pca": 0.5, "nn_runner": 0.5, "nn_runner_withbarplot": 0.5,
+                  "data_loader": 0.5, "get_kmer_frequencies": 0.5, "benchmark": 0.5}
+HEAVY_MODULES = ["pandas", "matplotlib", "seaborn", "sklearn", "scipy"]
+
+#-----------------------------------------------------------------------------------------------------------------
+#Synthetic inputs. Every generator is seeded, so the same size always gives the same input.
+#-----------------------------------------------------------------------------------------------------------------
+def make_ca_inputs(size, seed=0):
+    from ca_viewer import random_ics
+    rng = np.random.default_rng(seed)
+    rules = rng.integers(0, 2, (size["rules"], 128), dtype=np.uint8)
+    return rules, random_ics(size["ics"], size["width"], rng.integers(2**32))
+
+#Each group gets its own k-mer profile and each row (MAG) a genome size, and the counts are Poisson around that.
+def make_mag_table(file_name, size, seed=0):
+    rng = np.random.default_rng(seed)
+    profiles = rng.dirichlet(np.full(size["cols"], 5.0), size["groups"])
+    groups = rng.integers(0, size["groups"], size["rows"])
+    genome_sizes = rng.lognormal(np.log(2e5), 0.5, size["rows"])
+    counts = rng.poisson(genome_sizes[:, None] * profiles[groups])
+    with open(file_name, "w") as out:
+        out.write("species\t"+"\t".join("kmer"+str(n) for n in range(size["cols"]))+"\n")
+        for start in range(0, size["rows"], 10000):
+            rows = slice(start, start + 10000)
+            np.savetxt(out, np.column_stack((groups[rows], counts[rows])), fmt="%d", delimiter="\t")
+    return file_name
+
+#-----------------------------------------------------------------------------------------------------------------
+#Each benchmark is a setup function that builds its inputs (not timed) and returns the function to time.
+#-----------------------------------------------------------------------------------------------------------------
+def setup_benchmark(name, size, work_dir):
+    if name.startswith("ca_"):
+        import ca_viewer
+        rules, ics = make_ca_inputs(size)
+        rule, ic = "".join(map(str, rules[0])), "".join(map(str, ics[0]))
+        if name == "ca_reference":
+            return lambda: ca_viewer.run_2DCA(rule, ic, size["gens"])
+        if name == "ca_numpy":
+            return lambda: ca_viewer.run_ca(rule, ic, size["gens"])
+        if name == "ca_packed":
+            return lambda: ca_viewer.run_ca(rule, ic, size["gens"], packed=True)
+        return lambda: ca_viewer.run_batch(rules, ics, size["gens"])
+    from data_loader import load_table
+    table = os.path.join(work_dir, "mag_"+str(size["rows"])+"x"+str(size["cols"])+".tsv")
+    if not os.path.exists(table):
+        make_mag_table(table, size)
+    if name == "table_parse":
+        return lambda: load_table(table, use_cache=False)
+    labels, data, columns = load_table(table, use_cache=False)
+    if name == "pca":
+        from get_pca import fit_pca
+        return lambda: fit_pca(data, 2)
+    from nn_runner import build_classifier
+    def fit():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")              #a fixed number of epochs, so it never converges
+            build_classifier(verbose=False, max_iter=10, random_state=0).fit(data, labels.codes)
+    return fit
+
+def measure(func, repeats=3):
+    func()                                                 #warm up: pandas/sklearn are imported on the first call
+    seconds = []
+    for n in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "mean_seconds": float(np.mean(seconds)), "peak_mb": peak / 2**20}
+
+def run_benchmarks(sizes, names, repeats=3, work_dir=None):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="pml_bench_")
+    results = []
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for name in names:
+            if name == "ca_reference" and not size["reference"]:
+                continue                                   #the pure Python reference is too slow for this size
+            result = dict(benchmark=name, size=size_name, **measure(setup_benchmark(name, size, work_dir), repeats))
+            print(str("%-14s" % name)+str("%-8s" % size_name)+str("%10.4f" % result["seconds"])+" s"+str("%10.1f" % result["peak_mb"])+" MB")
+            results.append(result)
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+            "host": platform.node(), "repeats": repeats, "results": results}
+
+#-----------------------------------------------------------------------------------------------------------------
+#Compare a results file with a baseline. A benchmark regressed if it got more than threshold (a fraction) slower
+#or used more than threshold more peak memory, ignoring differences under min_seconds / min_mb (timer noise).
+#-----------------------------------------------------------------------------------------------------------------
+def compare_results(baseline, current, threshold=0.1, min_seconds=0.01, min_mb=1.0):
+    old = {(r["benchmark"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["benchmark"], result["size"])
+        if key not in old:
+            continue
+        base = old[key]
+        flags = []
+        if result["seconds"] > base["seconds"] * (1 + threshold) and result["seconds"] - base["seconds"] > min_seconds:
+            flags.append("TIME")
+        if result["peak_mb"] > base["peak_mb"] * (1 + threshold) and result["peak_mb"] - base["peak_mb"] > min_mb:
+            flags.append("MEMORY")
+        print(str("%-14s" % key[0])+str("%-8s" % key[1])+str("%10.4f" % base["seconds"])+" ->"+str("%9.4f" % result["seconds"])+" s ("+str("%+.0f" % (100 * (result["seconds"] / base["seconds"] - 1)))+"%)"
+              +str("%10.1f" % base["peak_mb"])+" ->"+str("%8.1f" % result["peak_mb"])+" MB  "+" ".join(flags))
+        if flags:
+            regressions.append((key, flags))
+    return regressions
+
+#-----------------------------------------------------------------------------------------------------------------
+#Import time of each script in a fresh interpreter (best of repeats) and the heavy libraries it loaded.
+#Returns the scripts that went over their budget or loaded a heavy library.
+#-----------------------------------------------------------------------------------------------------------------
+def measure_import(module, repeats=5):
+    code = "import sys, time, json; t = time.perf_counter(); import "+module+"; t = time.perf_counter() - t; "
+    code += "print(json.dumps([t, [m for m in "+repr(HEAVY_MODULES)+" if m in sys.modules]]))"
+    times = []
+    for n in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        seconds, heavy = json.loads(output.strip().splitlines()[-1])
+        times.append(seconds)
+    return min(times), heavy
+
+def check_imports(repeats=5):
+    failures = []
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds, heavy = measure_import(module, repeats)
+        ok = seconds <= budget and not heavy
+        print(str("%-24s" % module)+str("%8.3f" % seconds)+" s (budget "+str("%.2f" % budget)+" s)  "+("ok" if ok else "FAIL")+("  loads "+", ".join(heavy) if heavy else ""))
+        if not ok:
+            failures.append(module)
+    return failures
+
+def read_results(file_name):
+    with open(file_name) as fh:
+        return json.load(fh)
+
+def usage():
+    usage = "\nBenchmarks\n"
+    usage = usage + "\nUsage: benchmark.py -s sizes -o results.json\n"
+    usage = usage + "       benchmark.py -c baseline.json -i results.json\n"
+    usage = usage + "       benchmark.py -I\n"
+    usage = usage + "\nTimes the CA engines, table parsing, PCA and the MLP fit on seeded synthetic inputs.\n\n"
+    usage = usage + "  -s sizes         comma separated, from "+", ".join(SIZES)+" (default = small)\n"
+    usage = usage + "  -b benchmarks    comma separated, from "+", ".join(BENCHMARKS)+" (default = all)\n"
+    usage = usage + "  -r repeats       times each benchmark is run, the best time is kept (default = 3)\n"
+    usage = usage + "  -d directory     where the synthetic tables are written (default = a new temporary directory)\n"
+    usage = usage + "  -o out_file      results file (default = benchmark_results.json)\n"
+    usage = usage + "  -c baseline      compare mode: compare -i results (or a new run) with this baseline file,\n"
+    usage = usage + "                   exit status 1 if anything regressed\n"
+    usage = usage + "  -i results       results file to compare with the baseline\n"
+    usage = usage + "  -t threshold     fraction slower / bigger that counts as a regression (default = 0.1)\n"
+    usage = usage + "  -I               check that every script imports within its time budget without loading\n"
+    usage = usage + "                   "+", ".join(HEAVY_MODULES)+"; exit status 1 if not\n\n"
+    return usage
+
+def main(argv):
+    #---------------------------
+    #Read command line arguments
+    #---------------------------
+    sizes = ["small"]
+    names = BENCHMARKS
+    repeats = 3
+    work_dir = ""
+    out_file = "benchmark_results.json"
+    baseline_file = ""
+    in_file = ""
+    threshold = 0.1
+    imports = False
+    try:
+        opts, args = getopt.getopt(argv,"hs:b:r:d:o:c:i:t:I",["sizes=","benchmarks=","repeats=","dir=","ofile=","compare=","ifile=","threshold=","imports"])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(usage())
+                sys.exit()
+            elif opt in ("-s", "--sizes"):
+                sizes = arg.split(",")
+            elif opt in ("-b", "--benchmarks"):
+                names = arg.split(",")
+            elif opt in ("-r", "--repeats"):
+                repeats = int(arg)
+            elif opt in ("-d", "--dir"):
+                work_dir = arg
+            elif opt in ("-o", "--ofile"):
+                out_file = arg
+            elif opt in ("-c", "--compare"):
+                baseline_file = arg
+            elif opt in ("-i", "--ifile"):
+                in_file = arg
+            elif opt in ("-t", "--threshold"):
+                threshold = float(arg)
+            elif opt in ("-I", "--imports"):
+                imports = True
+    except (getopt.GetoptError, ValueError):
+        print("\nNot a valid argument or value")
+        print(usage())
+        sys.exit(2)
+    unknown = [s for s in sizes if s not in SIZES] + [b for b in names if b not in BENCHMARKS]
+    if unknown:
+        print("\nUnknown size or benchmark: "+", ".join(unknown))
+        print(usage())
+        sys.exit(2)
+
+    #-------------------
+    #Import time budgets
+    #-------------------
+    if imports:
+        failures = check_imports()
+        if failures:
+            print(str(len(failures))+" script(s) over their import budget: "+", ".join(failures))
+            sys.exit(1)
+        print("All imports within budget")
+        return
+
+    #------------------------------------------------
+    #Run the benchmarks (unless comparing saved ones)
+    #------------------------------------------------
+    try:
+        baseline = read_results(baseline_file) if baseline_file else None
+        current = read_results(in_file) if in_file else None
+    except (FileNotFoundError, ValueError):
+        print("\nNot a valid results file: "+(in_file or baseline_file)+"\n")
+        sys.exit(3)
+    if current is None:
+        if work_dir:
+            os.makedirs(work_dir, exist_ok=True)
+        current = run_benchmarks(sizes, names, repeats, work_dir)
+        with open(out_file, "w") as fh:
+            json.dump(current, fh, indent=2)
+        print("Results written to "+out_file)
+    if baseline is not None:
+        regressions = compare_results(baseline, current, threshold)
+        if regressions:
+            print(str(len(regressions))+" regression(s) over "+str("%.0f" % (100 * threshold))+"%")
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
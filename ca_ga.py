@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+###########################################################################
+### Cellular Automata Genetic Algorithm                                 ###
+### Usage: ca_ga.py -g generations -P population -c checkpoint_file    ###
+###                                                                     ###
+### Evolves 128-bit CA rules for the density classification task, the ###
+### way Melanie Mitchell's group did it (see ca_viewer.py). The fitness ###
+### of a rule is the fraction of random initial conditions it settles ###
+### to all 1s (majority 1) or all 0s (majority 0).                      ###
+###########################################################################
+
+import sys, getopt, os, json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ca_viewer import random_ics, run_batch, summarize_batch
+from data_loader import atomic_write
+
+#-----------------------------------------------------------------------------------------------------------------
+#Fitness of a stack of rules on one set of random ICs. The ICs are rebuilt from their seed, so only the seed has to
+#be sent to the worker processes. All the rules in the stack are run together as one batch.
+#-----------------------------------------------------------------------------------------------------------------
+def score_rules(rules, ic_seed, num_ics, width, ca_gens):
+    ics = random_ics(num_ics, width, ic_seed)
+    finals = run_batch(rules, ics, ca_gens)
+    correct = summarize_batch(ics, finals)[2]
+    return correct.mean(axis=1)
+
+#Least recently used cache of fitness values, keyed by the packed rule bits plus the IC seed.
+class FitnessCache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, rule, ic_seed):
+        return (np.packbits(rule).tobytes(), ic_seed)
+
+    def get(self, rule, ic_seed):
+        key = self.key(rule, ic_seed)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, rule, ic_seed, fitness):
+        self.entries[self.key(rule, ic_seed)] = fitness
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+def evaluate_population(population, ic_seed, settings, cache, pool, procs):
+    fitness = np.empty(len(population))
+    todo = []
+    for n, rule in enumerate(population):
+        value = cache.get(rule, ic_seed)
+        if value is None:
+            todo.append(n)
+        else:
+            fitness[n] = value
+    if todo:
+        chunk_size = -(-len(todo) // procs)
+        chunks = [todo[k:k+chunk_size] for k in range(0, len(todo), chunk_size)]
+        args = (ic_seed, settings["num_ics"], settings["width"], settings["ca_gens"])
+        if pool is None:
+            scores = [score_rules(population[chunk], *args) for chunk in chunks]
+        else:
+            scores = list(pool.map(score_rules, [population[chunk] for chunk in chunks], *[[a]*len(chunks) for a in args]))
+        for chunk, chunk_scores in zip(chunks, scores):
+            for n, value in zip(chunk, chunk_scores):
+                fitness[n] = value
+                cache.put(population[n], ic_seed, value)
+    return fitness
+
+#-----------------------------------------------------------------------------------------------------------------
+#One generation of the GA: the elite are copied unchanged, and the rest of the population is filled with children of
+#two elite parents (single point crossover), each bit of a child flipped with probability mutation_rate.
+#-----------------------------------------------------------------------------------------------------------------
+def next_generation(population, fitness, settings, rng):
+    order = np.argsort(-fitness, kind="stable")
+    elite = population[order[:settings["elite"]]]
+    num_children = len(population) - len(elite)
+    mothers = elite[rng.integers(0, len(elite), num_children)]
+    fathers = elite[rng.integers(0, len(elite), num_children)]
+    cut = rng.integers(1, population.shape[1], num_children)[:, None]
+    children = np.where(np.arange(population.shape[1])[None, :] < cut, mothers, fathers)
+    children ^= (rng.random(children.shape) < settings["mutation_rate"]).astype(np.uint8)
+    return np.concatenate((elite, children))
+
+def save_checkpoint(file_name, generation, population, fitness, rng, settings):
+    state = {
+        "generation": generation,
+        "settings": settings,
+        "population": ["".join(map(str, rule)) for rule in population],
+        "fitness": [float(f) for f in fitness],
+        "rng_state": rng.bit_generator.state,
+    }
+    def write(tmp_file):
+        with open(tmp_file, "w") as fh:
+            json.dump(state, fh)
+    atomic_write(file_name, write)
+
+def load_checkpoint(file_name):
+    with open(file_name) as fh:
+        state = json.load(fh)
+    population = np.array([[int(b) for b in rule] for rule in state["population"]], dtype=np.uint8)
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state["rng_state"]
+    return state["generation"], population, np.array(state["fitness"]), rng, state["settings"]
+
+def ic_seed_for(generation, settings):
+    if settings["refresh"] <= 0:
+        return settings["seed"]
+    return settings["seed"] + 1 + generation // settings["refresh"]
+
+def run_ga(settings, checkpoint_file="", procs=1, cache_size=10000):
+    cache = FitnessCache(cache_size)
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        start, population, fitness, rng, saved = load_checkpoint(checkpoint_file)
+        saved["generations"] = settings["generations"]     #allow a resumed run to go for longer
+        settings = saved
+        print("Resuming from "+checkpoint_file+" at generation "+str(start))
+        start += 1
+        if start < settings["generations"]:                   #otherwise the saved generation is the result
+            population = next_generation(population, fitness, settings, rng)
+    else:
+        start = 0
+        rng = np.random.default_rng(settings["seed"])
+        population = random_ics(settings["population"], 128, rng.integers(2**32))
+    pool = ProcessPoolExecutor(max_workers=procs) if procs > 1 else None
+    try:
+        for generation in range(start, settings["generations"]):
+            fitness = evaluate_population(population, ic_seed_for(generation, settings), settings, cache, pool, procs)
+            best = int(np.argmax(fitness))
+            print("Generation "+str(generation)+": best fitness = "+str("%.4f" % fitness[best])+", mean fitness = "+str("%.4f" % fitness.mean())+", cache hits = "+str(cache.hits)+", evaluations = "+str(cache.misses))
+            if checkpoint_file:
+                save_checkpoint(checkpoint_file, generation, population, fitness, rng, settings)
+            if generation < settings["generations"] - 1:
+                population = next_generation(population, fitness, settings, rng)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    order = np.argsort(-fitness, kind="stable")
+    return population[order], fitness[order]
+
+def usage():
+    usage = "\nCellular Automata Genetic Algorithm\n"
+    usage = usage + "\nUsage: ca_ga.py -g generations -P population -c checkpoint_file -o out_file\n"
+    usage = usage + "\nThis program evolves 128 bit CAs for the density classification task.\n"
+    usage = usage + "Fitness is the fraction of random initial conditions (ICs) classified correctly.\n\n"
+    usage = usage + "  -g generations   number of GA generations (default = 100)\n"
+    usage = usage + "  -P population    number of rules in the population (default = 100)\n"
+    usage = usage + "  -e elite         number of best rules copied to the next generation (default = 20)\n"
+    usage = usage + "  -m rate          probability of flipping each bit of a child (default = 2/128)\n"
+    usage = usage + "  -i num_ics       number of random ICs each rule is scored on (default = 100)\n"
+    usage = usage + "  -w width         width of the ICs (default = 149)\n"
+    usage = usage + "  -n num_gens      number of CA generations per IC (default = 320)\n"
+    usage = usage + "  -r refresh       draw new ICs every refresh generations (default = 0, never)\n"
+    usage = usage + "  -s seed          random seed (default = 0)\n"
+    usage = usage + "  -p procs         number of worker processes (default = number of cores)\n"
+    usage = usage + "  -c file          checkpoint file, written every generation and resumed from if it exists\n"
+    usage = usage + "  -o out_file      write the final population, best rule first (can be read by ca_viewer.py -R)\n\n"
+    return usage
+
+def main(argv):
+    #---------------------------
+    #Read command line arguments
+    #---------------------------
+    settings = {"generations": 100, "population": 100, "elite": 20, "mutation_rate": 2/128, "num_ics": 100,
+                "width": 149, "ca_gens": 320, "refresh": 0, "seed": 0}
+    procs = os.cpu_count() or 1
+    checkpoint_file = ""
+    out_file = ""
+    try:
+        opts, args = getopt.getopt(argv,"hg:P:e:m:i:w:n:r:s:p:c:o:",["generations=","population=","elite=","mutation=","ics=","width=","nint=","refresh=","seed=","procs=","checkpoint=","ofile="])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(usage())
+                sys.exit()
+            elif opt in ("-g", "--generations"):
+                settings["generations"] = int(arg)
+            elif opt in ("-P", "--population"):
+                settings["population"] = int(arg)
+            elif opt in ("-e", "--elite"):
+                settings["elite"] = int(arg)
+            elif opt in ("-m", "--mutation"):
+                settings["mutation_rate"] = float(arg)
+            elif opt in ("-i", "--ics"):
+                settings["num_ics"] = int(arg)
+            elif opt in ("-w", "--width"):
+                settings["width"] = int(arg)
+            elif opt in ("-n", "--nint"):
+                settings["ca_gens"] = int(arg)
+            elif opt in ("-r", "--refresh"):
+                settings["refresh"] = int(arg)
+            elif opt in ("-s", "--seed"):
+                settings["seed"] = int(arg)
+            elif opt in ("-p", "--procs"):
+                procs = int(arg)
+            elif opt in ("-c", "--checkpoint"):
+                checkpoint_file = arg
+            elif opt in ("-o", "--ofile"):
+                out_file = arg
+    except (getopt.GetoptError, ValueError):
+        print("\nNot a valid argument or value")
+        print(usage())
+        sys.exit(2)
+    if settings["generations"] < 1:
+        print("\nThe number of generations must be at least 1.\n")
+        sys.exit(2)
+    if not(0 < settings["elite"] < settings["population"]):
+        print("\nThe elite must be at least 1 and smaller than the population.\n")
+        sys.exit(2)
+
+    #-------------
+    #Run the GA
+    #-------------
+    population, fitness = run_ga(settings, checkpoint_file, procs)
+    print("Best CA = "+"".join(map(str, population[0])))
+    print("Fitness = "+str("%.4f" % fitness[0]))
+    if out_file:
+        with open(out_file, "w") as fh:
+            for rule in population:
+                fh.write("".join(map(str, rule))+"\n")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,14 +17,15 @@
 # and then runs the CA on the initial condition for 100 generations. You can change the number of generations it runs by running the program
 # with the -n argument (e.g. ca_viewer.py -n 500).
 
-import sys, getopt
-import pandas as pd
-import matplotlib.pyplot as plt
+import sys, getopt, os, hashlib, json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 #---------------------------------------------------------------------------------------------------------------
 #This function runs an 128 bit CA ... therefore neighborhoods are size 7 (because 2**7=128) and the radius is 3.
 #So, tack last three bits to beginning and first three bits to end .. then start at [3] and go to [len-3].
-#Would like to update this to handle radius = 1, 2, or 3 (CA length 8, 32 or 128) in the future. 
+#run_ca below handles radius = 1, 2, or 3 (CA length 8, 32 or 128); this version is kept as the reference.
 #---------------------------------------------------------------------------------------------------------------
 def run_2DCA(ca_string, input_string, num_gens):
     total_results = []
@@ -49,15 +50,376 @@ def run_2DCA(ca_string, input_string, num_gens):
         current_string = temp_string[lis-3:lis] + temp_string + temp_string[0:3] #new string for next generation
         total_results.append(this_result)                                        #new row in grid of integers for display
     return total_results
-        
+
+#---------------------------------------------------------------------------------------------------------------
+#NumPy version of run_2DCA. The lattice is kept as a uint8 array and all neighborhood indices for a generation
+#are built at once (with periodic wrap), then looked up in the rule table. The radius comes from the rule length:
+#8, 32 or 128 bits means radius 1, 2 or 3 (neighborhoods of 3, 5 or 7 cells).
+#Returns a num_gens x width uint8 array instead of a list of lists. run_2DCA above is kept as the reference.
+#
+#With packed=True the lattice is stored 64 cells to a uint64 word (cell i is bit i%64 of word i//64) and the
+#rows returned are words, 1/8 of the memory of one byte per cell. Use unpack_lattice to get the cells back.
+#---------------------------------------------------------------------------------------------------------------
+RULE_RADIUS = {8: 1, 32: 2, 128: 3}
+MAX_WINDOW = 1024                 #most generations -d can remember for cycle detection
+
+def bits_to_array(bit_string):
+    return np.frombuffer(bit_string.encode("ascii"), dtype=np.uint8) - ord("0")
+
+def as_bits(bits):
+    if isinstance(bits, str):
+        return bits_to_array(bits)
+    return np.asarray(bits, dtype=np.uint8)
+
+def rule_radius(num_bits):
+    if num_bits not in RULE_RADIUS:
+        raise ValueError("CA must be 8, 32 or 128 bits long, not "+str(num_bits))
+    return RULE_RADIUS[num_bits]
+
+def neighborhood_index(padded, width, radius, out):
+    out[...] = padded[..., 0:width]
+    for j in range(1, 2*radius + 1):                #leftmost cell of the neighborhood is the most significant bit
+        out <<= 1
+        out |= padded[..., j:j+width]
+    return out
+
+def ca_stepper(ca_string, width, packed=False):
+    rule = as_bits(ca_string)
+    radius = rule_radius(len(rule))
+    if packed:
+        def step(previous, out):
+            out[...] = packed_step(previous, rule, radius, width)
+        return step
+    wrap = np.arange(-radius, width + radius) % width      #indices of the lattice with the last/first radius cells tacked on
+    ca_index = np.empty(width, dtype=np.uint8)
+    def step(previous, out):
+        neighborhood_index(previous.take(wrap), width, radius, ca_index)
+        rule.take(ca_index, out=out)
+    return step
+
+def new_results(state, num_gens, packed=False, out=None):
+    first = pack_lattice(state) if packed else state
+    if out is None:
+        out = np.empty((max(int(num_gens), 1), len(first)), dtype=first.dtype)
+    out[0] = first
+    return out
+
+#out can be a preallocated array (e.g. an np.memmap, see run_ca_to_file) to write the generations into.
+def run_ca(ca_string, input_string, num_gens, packed=False, out=None):
+    state = as_bits(input_string)
+    step = ca_stepper(ca_string, len(state), packed)
+    results = new_results(state, num_gens, packed, out)
+    for i in range(1, len(results)):
+        step(results[i-1], results[i])
+    return results
+
+#---------------------------------------------------------------------------------------------------------------
+#Same as run_ca, but each generation is hashed and the run stops as soon as a state repeats (most rules settle
+#on a fixed point or a short cycle well before num_gens). Only the last window generations are remembered.
+#Returns (results, transient, period) where results[transient] is the first state of the cycle, or
+#(results, None, None) if no repeat was seen. With fill=True the rest of results is filled in by repeating the
+#cycle, so it matches run_ca exactly; otherwise results stops at the first repeated generation.
+#---------------------------------------------------------------------------------------------------------------
+def state_digest(row, packed=False):
+    data = row.tobytes() if packed else np.packbits(row).tobytes()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def run_ca_cycles(ca_string, input_string, num_gens, packed=False, window=1024, fill=True, out=None):
+    state = as_bits(input_string)
+    step = ca_stepper(ca_string, len(state), packed)
+    results = new_results(state, num_gens, packed, out)
+    seen = {}
+    order = deque()
+    for i in range(len(results)):
+        if i > 0:
+            step(results[i-1], results[i])
+        digest = state_digest(results[i], packed)
+        if digest in seen:
+            transient = seen[digest]
+            period = i - transient
+            if fill:
+                for start in range(i+1, len(results), 4096):   #a block at a time so a memmap is never read in whole
+                    rows = np.arange(start, min(start + 4096, len(results)))
+                    results[rows] = results[transient + (rows - transient) % period]
+                return results, transient, period
+            return results[:i+1], transient, period
+        seen[digest] = i
+        order.append(digest)
+        if len(order) > window:
+            del seen[order.popleft()]
+    return results, None, None
+
+#---------------------------------------------------------------------------------------------------------------
+#Bit-packed engine. Each neighbor of every cell is one shifted copy of the packed lattice, and the rule table is
+#applied to all 64 cells of a word at once as a tree of multiplexers (one level per neighborhood bit), so a
+#generation costs a few hundred word operations per 64 cells. Shifting whole words wraps around at num_words*64,
+#so when the width is not a multiple of 64 the radius cells at each end are recomputed directly.
+#---------------------------------------------------------------------------------------------------------------
+def pack_lattice(state):
+    state = as_bits(state)
+    width = state.shape[-1]
+    num_words = (width + 63) // 64
+    padded = np.zeros(state.shape[:-1] + (num_words*64,), dtype=np.uint8)
+    padded[..., :width] = state
+    return np.packbits(padded, axis=-1, bitorder="little").view("<u8")
+
+def unpack_lattice(words, width):
+    words = np.ascontiguousarray(words, dtype="<u8")
+    return np.unpackbits(words.view(np.uint8), axis=-1, bitorder="little")[..., :width]
+
+def shift_lattice(words, s):
+    #new cell i = old cell i+s, wrapping around at the end of the last word
+    if s > 0:
+        return (words >> np.uint64(s)) | (np.roll(words, -1) << np.uint64(64 - s))
+    if s < 0:
+        return (words << np.uint64(-s)) | (np.roll(words, 1) >> np.uint64(64 + s))
+    return words
+
+def _mux(x, not_x, a, b):
+    #a where x is 0, b where x is 1 ... a and b are either 0/1 constants or arrays of words
+    if isinstance(a, int) and isinstance(b, int):
+        if a == b:
+            return a
+        return x if b == 1 else not_x
+    if a is b:
+        return a
+    if isinstance(a, int):
+        return (x & b) if a == 0 else (not_x | b)
+    if isinstance(b, int):
+        return (not_x & a) if b == 0 else (x | a)
+    return a ^ (x & (a ^ b))
+
+def packed_step(words, rule, radius, width):
+    size = 2*radius + 1
+    nodes = [int(b) for b in rule]                  #leaves of the tree, one per neighborhood
+    for k in range(size - 1, -1, -1):               #least significant neighborhood bit first
+        x = shift_lattice(words, k - radius)
+        not_x = ~x
+        nodes = [_mux(x, not_x, nodes[2*j], nodes[2*j+1]) for j in range(len(nodes)//2)]
+    result = nodes[0]
+    if isinstance(result, int):
+        result = np.full(words.shape, ~np.uint64(0) if result else np.uint64(0), dtype="<u8")
+    if width % 64:
+        edge = np.concatenate((np.arange(radius), np.arange(width - radius, width)))
+        positions = (edge[:, None] + np.arange(-radius, radius + 1)[None, :]) % width
+        bits = (words[positions >> 6] >> (positions & 63).astype(np.uint64)) & np.uint64(1)
+        ca_index = (bits.astype(np.intp) << np.arange(size - 1, -1, -1)).sum(axis=1)
+        for cell, value in zip(edge, rule[ca_index]):
+            mask = np.uint64(1) << np.uint64(cell & 63)
+            if value:
+                result[cell >> 6] |= mask
+            else:
+                result[cell >> 6] &= ~mask
+        result[-1] &= np.uint64((1 << (width % 64)) - 1)   #keep the unused bits of the last word at 0
+    return result
+
+#---------------------------------------------------------------------------------------------------------------
+#Streaming output for long, wide runs. iter_ca yields one generation at a time from two alternating buffers
+#(copy a row if you need to keep it), and run_ca_to_file writes the generations into a .npy file on disk through
+#np.memmap, so only the pages being written are in memory. downsample_results reads the rows back a block at a
+#time and averages them down to at most max_rows x max_cols for display.
+#---------------------------------------------------------------------------------------------------------------
+def iter_ca(ca_string, input_string, num_gens, packed=False):
+    state = as_bits(input_string)
+    step = ca_stepper(ca_string, len(state), packed)
+    buffers = new_results(state, 2, packed)
+    yield buffers[0]
+    for i in range(1, max(int(num_gens), 1)):
+        step(buffers[(i-1) % 2], buffers[i % 2])
+        yield buffers[i % 2]
+
+def run_ca_to_file(ca_string, input_string, num_gens, file_name, packed=False, window=1024):
+    width = len(as_bits(input_string))
+    shape = (max(int(num_gens), 1), (width + 63) // 64 if packed else width)
+    out = np.lib.format.open_memmap(file_name, mode="w+", dtype="<u8" if packed else np.uint8, shape=shape)
+    results, transient, period = run_ca_cycles(ca_string, input_string, num_gens, packed=packed, window=window, out=out)
+    results.flush()
+    return results, transient, period
+
+def downsample_results(results, max_rows=1000, max_cols=1000, width=None):
+    packed = results.dtype != np.uint8
+    if width is None:
+        width = results.shape[1] * 64 if packed else results.shape[1]
+    row_step = -(-len(results) // max_rows)
+    col_step = -(-width // max_cols)
+    if row_step == 1 and col_step == 1 and not packed:
+        return np.asarray(results)
+    num_cols = -(-width // col_step)
+    view = np.empty((-(-len(results) // row_step), num_cols), dtype=np.float32)
+    for k in range(len(view)):
+        block = results[k*row_step:(k+1)*row_step]
+        if packed:
+            block = unpack_lattice(block, width)
+        counts = np.zeros(num_cols * col_step, dtype=np.float32)
+        counts[:width] = block.sum(axis=0)
+        cells = np.full(num_cols, col_step * len(block), dtype=np.float32)
+        cells[-1] = (width - (num_cols - 1) * col_step) * len(block)
+        view[k] = counts.reshape(num_cols, col_step).sum(axis=1) / cells
+    return view
+
+#---------------------------------------------------------------------------------------------------------------
+#Batch evaluation: run one or more rules on a whole matrix of initial conditions (ICs), one IC per row.
+#Every (rule, IC) pair becomes one row of a 2D lattice and all rows are advanced together, so a generation is a
+#single array update no matter how many ICs there are. No figures are built here.
+#---------------------------------------------------------------------------------------------------------------
+def to_bit_matrix(bits):
+    if isinstance(bits, str):
+        bits = [bits]
+    if len(bits) > 0 and isinstance(bits[0], str):
+        return np.array([bits_to_array(b) for b in bits], dtype=np.uint8)
+    return np.atleast_2d(np.asarray(bits, dtype=np.uint8))
+
+#Random ICs as in Mitchell's density classification experiments: the density of each IC is drawn uniformly
+#from [0,1] and then each bit is on with that probability.
+def random_ics(num_ics, width, seed=None):
+    rng = np.random.default_rng(seed)
+    densities = rng.random((num_ics, 1))
+    return (rng.random((num_ics, width)) < densities).astype(np.uint8)
+
+#With window > 0 the packed state of every row is hashed each generation and compared with the last window
+#generations. A row that repeats has reached its fixed point or cycle, so its state at the last generation is
+#read straight from the cycle and the row is dropped from the update. The batch stops once every row has settled.
+#run_batch_cycles also returns the transient length and cycle period of each (rule, IC), -1 if none was found.
+def run_batch_cycles(rules, ics, num_gens, window=16):
+    rules = to_bit_matrix(rules)
+    radius = rule_radius(rules.shape[1])
+    ics = to_bit_matrix(ics)
+    num_rules = len(rules)
+    num_ics, width = ics.shape
+    last = max(int(num_gens), 1) - 1
+    states = np.tile(ics, (num_rules, 1))                  #row r*num_ics + k is rule r on IC k
+    offsets = (np.repeat(np.arange(num_rules), num_ics) * rules.shape[1]).astype(np.int32)[:, None]
+    flat_rules = rules.ravel()
+    wrap = np.arange(-radius, width + radius) % width
+    finals = np.empty_like(states)
+    transient = np.full(len(states), -1)
+    period = np.full(len(states), -1)
+    rows = np.arange(len(states))                          #original row of each row still running
+    num_bytes = (width + 7) // 8
+    num_words = (num_bytes + 7) // 8
+    multipliers = np.random.default_rng(0).integers(0, 2**63, num_words, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    history = np.zeros((window, len(states), num_words*8), dtype=np.uint8)
+    hashes = np.zeros((window, len(states)), dtype=np.uint64)
+    for i in range(last + 1):
+        if i > 0:
+            ca_index = np.empty(states.shape, dtype=np.int32)
+            neighborhood_index(states.take(wrap, axis=1), width, radius, ca_index)
+            ca_index += offsets                             #point each row at its own rule in the flattened stack
+            flat_rules.take(ca_index, out=states)
+        if window <= 0 or i == last:
+            continue
+        packed = np.zeros((len(states), num_words*8), dtype=np.uint8)
+        packed[:, :num_bytes] = np.packbits(states, axis=1)
+        digest = (packed.view("<u8") * multipliers).sum(axis=1)
+        settled = np.zeros(len(states), dtype=bool)
+        for lag in range(1, min(i, window) + 1):
+            slot = (i - lag) % window
+            found = ~settled & (hashes[slot] == digest)
+            if not found.any():
+                continue
+            found[found] = np.all(history[slot][found] == packed[found], axis=1)
+            transient[rows[found]] = i - lag
+            period[rows[found]] = lag
+            steps_left = (last - i) % lag                   #state at the last generation is this far into the cycle
+            if steps_left == 0:
+                finals[rows[found]] = states[found]
+            else:
+                finals[rows[found]] = np.unpackbits(history[(i - lag + steps_left) % window][found], axis=1)[:, :width]
+            settled |= found
+        history[i % window] = packed
+        hashes[i % window] = digest
+        if settled.any():
+            keep = ~settled
+            states, offsets, rows = states[keep], offsets[keep], rows[keep]
+            history, hashes = history[:, keep], hashes[:, keep]
+            if len(rows) == 0:
+                break
+    finals[rows] = states
+    return finals.reshape(num_rules, num_ics, width), transient.reshape(num_rules, num_ics), period.reshape(num_rules, num_ics)
+
+def run_batch(rules, ics, num_gens, window=16):
+    return run_batch_cycles(rules, ics, num_gens, window)[0]
+
+#Same as run_batch_cycles, but large batches of ICs are split into chunks and spread across a process pool.
+def run_batch_parallel(rules, ics, num_gens, procs=None, chunk_size=256, window=16):
+    rules = to_bit_matrix(rules)
+    ics = to_bit_matrix(ics)
+    if procs is None:
+        procs = os.cpu_count() or 1
+    if procs <= 1 or len(ics) <= chunk_size:
+        return run_batch_cycles(rules, ics, num_gens, window)
+    chunks = [ics[k:k+chunk_size] for k in range(0, len(ics), chunk_size)]
+    with ProcessPoolExecutor(max_workers=procs) as pool:
+        parts = list(pool.map(run_batch_cycles, [rules]*len(chunks), chunks, [num_gens]*len(chunks), [window]*len(chunks)))
+    return tuple(np.concatenate([part[n] for part in parts], axis=1) for n in range(3))
+
+#Per-IC summary statistics for a batch: the initial density of each IC, the final density for each (rule, IC),
+#and whether the rule classified the IC correctly (all 1s if the majority was 1, all 0s if the majority was 0).
+def summarize_batch(ics, finals):
+    ics = to_bit_matrix(ics)
+    initial_density = ics.mean(axis=1)
+    final_density = finals.mean(axis=2)
+    majority = (initial_density > 0.5)[None, :]
+    correct = np.where(majority, final_density == 1.0, final_density == 0.0) & (initial_density != 0.5)[None, :]
+    return initial_density, final_density, correct
+
+def read_bit_strings(file_name):
+    with open(file_name) as fh:
+        return [line.strip() for line in fh if line.strip() != ""]
+
+def run_batch_mode(rules, ics, num_gens, procs, out_file, write_finals, window):
+    print("Running "+str(len(rules))+" CA(s) on "+str(len(ics))+" initial conditions for "+str(num_gens)+" generations...", file=sys.stderr)
+    finals, transient, period = run_batch_parallel(rules, ics, num_gens, procs=procs, window=window)
+    initial_density, final_density, correct = summarize_batch(ics, finals)
+    out = open(out_file, "w") if out_file else sys.stdout
+    if write_finals:
+        out.write("rule\tic\tfinal_state\n")
+    else:
+        out.write("rule\tic\tinitial_density\tfinal_density\tcorrect\ttransient\tperiod\n")
+    for r in range(len(rules)):
+        for k in range(len(ics)):
+            if write_finals:
+                out.write(str(r)+"\t"+str(k)+"\t"+"".join(map(str, finals[r, k]))+"\n")
+            else:
+                out.write(str(r)+"\t"+str(k)+"\t"+str("%.4f" % initial_density[k])+"\t"+str("%.4f" % final_density[r, k])+"\t"+str(int(correct[r, k]))+"\t"+str(transient[r, k])+"\t"+str(period[r, k])+"\n")
+    if out_file:
+        out.close()
+    for r in range(len(rules)):
+        print("Rule "+str(r)+" fraction correct = "+str("%.4f" % correct[r].mean())+", settled = "+str("%.4f" % (period[r] > 0).mean()), file=sys.stderr)
+
+#Prompts go to log (stderr with --no-plot, so stdout only has the results); end of input counts as Q.
+def ask(prompt, log):
+    print(prompt, end="", file=log, flush=True)
+    try:
+        return input()
+    except EOFError:
+        return "Q"
+
 def usage():
     usage = "\nCellular Autotmata Viewer\n"
-    usage = usage + "\nUsage: ca_viewer.py -n num_gens -c CA\n"
+    usage = usage + "\nUsage: ca_viewer.py -n num_gens -i CA\n"
     usage = usage + "\nThis program takes a 128 bit CA, and requests user input for bit strings.\n"
     usage = usage + "It then runs the CA on the bit string for num_gens generations.\n\n"
-    usage = usage + "The CA must be 128 bits long exactly.\nThe input bit strings must be at least 7 bits long.\n"
+    usage = usage + "The CA must be 8, 32 or 128 bits long exactly (radius 1, 2 or 3).\n"
+    usage = usage + "The input bit strings must be at least 2*radius+1 bits long (7 bits for a 128 bit CA).\n"
+    usage = usage + "Use -k to run the bit-packed engine (64 cells per word) for very wide lattices.\n"
+    usage = usage + "Use -m file.npy to stream the generations to a memory-mapped file instead of keeping them in memory;\n"
+    usage = usage + "the plot is then a downsampled view read back from the file.\n"
     usage = usage + "If num_gens is not provided the CA will run for 100 generations.\n"
-    usage = usage + "At any prompt, <enter> or Q<enter> will quit the program.\n\n"
+    usage = usage + "At any prompt, <enter> or Q<enter> will quit the program.\n"
+    usage = usage + "Use --no-plot to run without matplotlib: each run is written to the screen as one line of JSON\n"
+    usage = usage + "(the prompts and messages go to stderr), e.g. echo 0110100110010110111 | ca_viewer.py --no-plot\n\n"
+    usage = usage + "Batch mode (no prompts, no plots):\n"
+    usage = usage + "  -b ic_file     run on every initial condition in ic_file (one bit string per line)\n"
+    usage = usage + "  -r num_ics     run on num_ics random initial conditions instead\n"
+    usage = usage + "  -w width       width of the random initial conditions (default = 149)\n"
+    usage = usage + "  -s seed        seed for the random initial conditions\n"
+    usage = usage + "  -R rule_file   run every CA in rule_file (one per line) instead of the single CA\n"
+    usage = usage + "  -p procs       number of worker processes (default = number of cores)\n"
+    usage = usage + "  -o out_file    write results to out_file instead of the screen\n"
+    usage = usage + "  -f             write the final states instead of the per-IC summary statistics\n"
+    usage = usage + "  -d window      stop each run once it repeats one of its last window generations\n"
+    usage = usage + "                 (0 to "+str(MAX_WINDOW)+", default = 16, 0 = off)\n\n"
     usage = usage + "Jennifer Meneghin\n"
     usage = usage + "February 18, 2020\n\n"
     return usage
@@ -68,84 +430,170 @@ def main(argv):
     #---------------------------
     ca_string = "00000000001111111111000000000011111111110000000000111111111100000000001111111111000000000011111111110000000000111111111111111111"
     num_gens = 100
+    ic_file = ""
+    num_random = 0
+    width = 149
+    seed = None
+    rule_file = ""
+    procs = None
+    out_file = ""
+    write_finals = False
+    packed = False
+    window = 16
+    mmap_file = ""
+    plot = True
     try:
-        opts, args = getopt.getopt(argv,"hi:n:",["istring=","nint="])
-    except getopt.GetoptError:
+        opts, args = getopt.getopt(argv,"hi:n:b:r:w:s:R:p:o:fkd:m:",["istring=","nint=","icfile=","random=","width=","seed=","rulefile=","procs=","ofile=","finals","packed","cycles=","mmap=","no-plot"])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(usage())
+                sys.exit()
+            elif opt in ("-i", "--istring"):
+                ca_string = arg
+            elif opt in ("-n", "--nint"):
+                num_gens = int(arg)
+            elif opt in ("-b", "--icfile"):
+                ic_file = arg
+            elif opt in ("-r", "--random"):
+                num_random = int(arg)
+            elif opt in ("-w", "--width"):
+                width = int(arg)
+            elif opt in ("-s", "--seed"):
+                seed = int(arg)
+            elif opt in ("-R", "--rulefile"):
+                rule_file = arg
+            elif opt in ("-p", "--procs"):
+                procs = int(arg)
+            elif opt in ("-o", "--ofile"):
+                out_file = arg
+            elif opt in ("-f", "--finals"):
+                write_finals = True
+            elif opt in ("-k", "--packed"):
+                packed = True
+            elif opt in ("-d", "--cycles"):
+                window = int(arg)
+            elif opt in ("-m", "--mmap"):
+                mmap_file = arg
+            elif opt == "--no-plot":
+                plot = False
+    except (getopt.GetoptError, ValueError):
         print("\nNot a valid argument or value")
         print(usage())
         sys.exit(2)
-    for opt, arg in opts:
-        if opt == "-h":
-            print(usage())
-            sys.exit()
-        elif opt in ("-i", "--istring"):
-            ca_string = arg
-        elif opt in ("-n", "--nint"):
-            num_gens = arg
-    if not(len(ca_string) == 128):
-        print("\n\nInput String must be exactly 128 bits. You only entered "+str(len(ca_string))+" bits.\n\n")
+    if not(0 <= window <= MAX_WINDOW):
+        print("\n\nThe cycle window must be from 0 to "+str(MAX_WINDOW)+" generations.\n\n")
+        sys.exit(2)
+    if not(len(ca_string) in RULE_RADIUS):
+        print("\n\nInput String must be exactly 8, 32 or 128 bits. You entered "+str(len(ca_string))+" bits.\n\n")
         sys.exit(2)
     try:
         checker = int(ca_string,2)
     except ValueError:
         print("\n\nCA String must be a bit string -- 0s and 1s only please.\n\n")
         sys.exit(2)
-    print("Running CA = "+ca_string)
-    print("for "+str(num_gens)+" generations...")
+
+    #-------------------------------------------------------
+    #Batch mode: many ICs (and maybe many CAs), no prompting
+    #-------------------------------------------------------
+    if ic_file or num_random > 0:
+        rules = [ca_string]
+        if rule_file:
+            try:
+                rules = read_bit_strings(rule_file)
+            except FileNotFoundError:
+                print("\nRule file "+rule_file+" not found.\n")
+                sys.exit(2)
+        for rule in rules:
+            if len(rule) != len(rules[0]) or not(len(rule) in RULE_RADIUS) or rule.strip("01") != "":
+                print("\n\nEvery CA in the rule file must be a bit string of the same length, exactly 8, 32 or 128 bits long.\n\n")
+                sys.exit(2)
+        if ic_file:
+            try:
+                ic_strings = read_bit_strings(ic_file)
+            except FileNotFoundError:
+                print("\nInitial condition file "+ic_file+" not found.\n")
+                sys.exit(2)
+            for ic in ic_strings:
+                if len(ic) != len(ic_strings[0]) or len(ic) < 2*rule_radius(len(rules[0]))+1 or ic.strip("01") != "":
+                    print("\n\nInitial conditions must be bit strings of the same length, at least 2*radius+1 bits long.\n\n")
+                    sys.exit(2)
+            ics = to_bit_matrix(ic_strings)
+        else:
+            ics = random_ics(num_random, width, seed)
+        run_batch_mode(rules, ics, num_gens, procs, out_file, write_finals, window)
+        sys.exit(0)
+
+    log = sys.stdout if plot else sys.stderr         #with --no-plot only the JSON results go to stdout
+    print("Running CA = "+ca_string, file=log)
+    print("for "+str(num_gens)+" generations...", file=log)
 
     #-------------------------------------
     #Keep going until user decides to quit
     #-------------------------------------
     input_string = ""
     while not(input_string == "Q"):
+        min_bits = 2*rule_radius(len(ca_string)) + 1
 
-        #---------------------------------------------------
-        # Get Bit String at least 7 bits long and 128-bit CA
-        #---------------------------------------------------
-        input_string = input("Please enter a bit string at least 7 bits long, I to enter a new CA, or Q to quit: ")
+        #------------------------------------------------------------------
+        # Get Bit String at least 2*radius+1 bits long and 8/32/128-bit CA
+        #------------------------------------------------------------------
+        input_string = ask("Please enter a bit string at least "+str(min_bits)+" bits long, I to enter a new CA, or Q to quit: ", log)
         if input_string == "Q" or input_string == "q":
-            print("\n\nThank you for using the CA Viewer.\n\n")
+            print("\n\nThank you for using the CA Viewer.\n\n", file=log)
             sys.exit(0)
         if input_string == "I" or input_string == "i":
-            new_ca_string = input("Please enter a bit string that is exactly 128 bits long: ")
-            if len(new_ca_string) < 128:
-                print("\n\nCellular Automata (CA) must be exactly 128 bits. You only entered "+str(len(new_ca_string))+" characters.\n\n")
-                continue
-            if len(new_ca_string) > 128:
-                print("\n\nCellular Automata (CA) must be exactly 128 bits. You entered "+str(len(new_ca_string))+" characters.\n\n")
+            new_ca_string = ask("Please enter a bit string that is exactly 8, 32 or 128 bits long: ", log)
+            if new_ca_string == "Q" or new_ca_string == "q":
+                print("\n\nThank you for using the CA Viewer.\n\n", file=log)
+                sys.exit(0)
+            if not(len(new_ca_string) in RULE_RADIUS):
+                print("\n\nCellular Automata (CA) must be exactly 8, 32 or 128 bits. You entered "+str(len(new_ca_string))+" characters.\n\n", file=log)
                 continue
             try:
                 checker = int(new_ca_string,2)
             except ValueError:
-                print("\n\nCellular Automata (CA) must be a bit string -- 0s and 1s only please.\n\n")
+                print("\n\nCellular Automata (CA) must be a bit string -- 0s and 1s only please.\n\n", file=log)
                 continue
             ca_string = new_ca_string
-            print("\n\nThank you.")
-            print("Now Running CA = "+ca_string)
+            print("\n\nThank you.", file=log)
+            print("Now Running CA = "+ca_string, file=log)
             continue
-        if len(input_string) < 7:
-            print("\n\nInput String must be at least 7 bits. You only entered "+str(len(input_string))+" characters.\n\n")
+        if len(input_string) < min_bits:
+            print("\n\nInput String must be at least "+str(min_bits)+" bits. You only entered "+str(len(input_string))+" characters.\n\n", file=log)
             #sys.exit(3)
             continue
         try:
             checker = int(input_string,2)
         except ValueError:
-            print("\n\nInput String must be a bit string -- 0s and 1s only please.\n\n")
+            print("\n\nInput String must be a bit string -- 0s and 1s only please.\n\n", file=log)
             continue
             #sys.exit(4)
 
         #--------------
         # Run the 2D CA
         #--------------
-        total_results = run_2DCA(ca_string, input_string, num_gens)
+        if mmap_file:
+            total_results, transient, period = run_ca_to_file(ca_string, input_string, num_gens, mmap_file, packed=packed, window=max(window, 1))
+            print("Generations written to "+mmap_file, file=log)
+        else:
+            total_results, transient, period = run_ca_cycles(ca_string, input_string, num_gens, packed=packed, window=max(window, 1))
+        if period == 1:
+            print("Fixed point reached at generation "+str(transient), file=log)
+        elif period:
+            print("Cycle of period "+str(period)+" reached at generation "+str(transient), file=log)
+        if not plot:
+            final = unpack_lattice(total_results[-1], len(input_string)) if packed else total_results[-1]
+            print(json.dumps({"ca": ca_string, "ic": input_string, "generations": len(total_results), "transient": transient, "period": period,
+                              "final_state": "".join(map(str, final)), "final_density": float(np.mean(final))}), flush=True)
+            continue
 
         #----------
         # Plot Grid
         #----------
+        import matplotlib.pyplot as plt                #only imported when there is something to plot
         fig = plt.figure()
         ax = fig.add_subplot(111)
-        ndf = pd.DataFrame(total_results, dtype=int)
-        ax.imshow(ndf)
+        ax.imshow(downsample_results(total_results, width=len(input_string)))
         ax.set_title('Results of 2D CA for '+str(num_gens)+' generations')
         plt.show()
 
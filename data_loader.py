@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+##############################################################################
+### Data Loader                                                            ###
+###                                                                        ###
+### Shared loader for the tab delimited files used by get_pca.py and       ###
+### nn_runner.py, where column 1 = group/label and the rest of the         ###
+### columns are numeric data. Parsing a big file costs more than fitting   ###
+### it, so the parsed label column and numeric matrix are cached as .npy   ###
+### files and memory-mapped on the next run. pandas is only imported       ###
+### when a file has to be parsed (never on a cache hit), so importing      ###
+### this module and loading a cached file are both cheap.                  ###
+###                                                                        ###
+### Usage: data_loader.py -i <tab delim file>   (parse and cache a file)   ###
+###        data_loader.py -c                    (clear the cache)          ###
+##############################################################################
+
+import sys, getopt, os, json, hashlib, shutil, time, resource
+import numpy as np
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "python-machine-learning")
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024**3
+
+def cache_dir_default():
+    return os.environ.get("PML_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+def cache_max_bytes_default():
+    return int(os.environ.get("PML_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+
+#-----------------------------------------------------------------------------------------------------------
+#Content hash of a file. Hashing is much cheaper than parsing, but it still reads the whole file, so the hash
+#is remembered in index.json together with the file's size and mtime and only recomputed when those change.
+#-----------------------------------------------------------------------------------------------------------
+def file_hash(file_name):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_name, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "index.json")) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+#write(tmp_file) writes the contents to a temporary file that is then renamed over file_name, so a reader (or
+#the next run, if this one is killed) never sees a half written file.
+def atomic_write(file_name, write):
+    tmp_file = file_name + ".tmp" + str(os.getpid())
+    write(tmp_file)
+    os.replace(tmp_file, file_name)
+
+def write_index(cache_dir, index):
+    def write(tmp_file):
+        with open(tmp_file, "w") as fh:
+            json.dump(index, fh)
+    atomic_write(os.path.join(cache_dir, "index.json"), write)
+
+def cache_key(file_name, cache_dir, dtype=np.float32):
+    path = os.path.abspath(file_name)
+    info = os.stat(path)
+    index = read_index(cache_dir)
+    entry = index.get(path)
+    if entry and entry["size"] == info.st_size and entry["mtime_ns"] == info.st_mtime_ns:
+        content = entry["hash"]
+    else:
+        content = file_hash(path)
+        index[path] = {"size": info.st_size, "mtime_ns": info.st_mtime_ns, "hash": content}
+        write_index(cache_dir, index)
+    return content + "-" + np.dtype(dtype).name + "-v" + str(CACHE_VERSION)
+
+#-----------------------------------------------------------------------------------------------------------
+#Row labels as numbers (codes, -1 = missing) plus the name of each number (categories). It has the parts of a
+#pandas Categorical the scripts use, so a cache hit never has to import pandas; np.asarray(labels) gives the
+#name of every row.
+#-----------------------------------------------------------------------------------------------------------
+class Labels:
+    def __init__(self, codes, categories):
+        self.codes = np.asarray(codes)
+        self.categories = np.asarray(categories)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __array__(self, dtype=None, copy=None):
+        names = self.categories
+        if len(self.codes) and self.codes.min() < 0:
+            names = np.append(names.astype(object), [None])   #code -1 picks the None on the end
+        return np.asarray(names[self.codes], dtype=dtype)
+
+#-----------------------------------------------------------------------------------------------------------
+#Each cache entry is a directory holding data.npy (the numeric matrix), codes.npy (the label of every row as
+#a number) and meta.json (column names and label categories). The mtime of meta.json is touched on every hit,
+#so the least recently used entries are the first to go once the cache grows past its size cap.
+#-----------------------------------------------------------------------------------------------------------
+def entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+
+def evict(cache_dir, max_bytes):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        meta_file = os.path.join(entry_dir, "meta.json")
+        if os.path.isfile(meta_file):
+            entries.append((os.path.getmtime(meta_file), entry_size(entry_dir), entry_dir))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and total > max_bytes:
+        _, size, entry_dir = entries.pop(0)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+def store_entry(cache_dir, key, labels, data, columns, max_bytes):
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "data.npy"), data)
+    np.save(os.path.join(tmp_dir, "codes.npy"), labels.codes)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+        json.dump({"columns": list(columns), "categories": labels.categories.tolist()}, fh)
+    try:
+        os.rename(tmp_dir, entry_dir)                      #another process may have stored it first
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict(cache_dir, max_bytes)
+
+def load_entry(cache_dir, key):
+    entry_dir = os.path.join(cache_dir, key)
+    meta_file = os.path.join(entry_dir, "meta.json")
+    try:
+        with open(meta_file) as fh:
+            meta = json.load(fh)
+        codes = np.load(os.path.join(entry_dir, "codes.npy"))
+        data = np.load(os.path.join(entry_dir, "data.npy"), mmap_mode="r")
+    except (FileNotFoundError, ValueError):
+        return None
+    os.utime(meta_file)
+    return Labels(codes, meta["categories"]), data, meta["columns"]
+
+#-----------------------------------------------------------------------------------------------------------
+#Parsing. The label column is read as a pandas category (codes plus one copy of each name) and every other
+#column straight into dtype (float32 by default, a quarter of what the default float64 + object frame costs),
+#so no object arrays are made for the data. iter_table yields (labels, data, columns) chunk_size rows at a time.
+#engine is the pandas parser: 'c' (default) or 'pyarrow' if it is installed (pyarrow reads the whole file).
+#-----------------------------------------------------------------------------------------------------------
+def read_header(in_file):
+    import pandas as pd
+    return list(pd.read_csv(in_file, sep='\t', nrows=0).columns)
+
+def column_dtypes(columns, dtype):
+    dtypes = {name: dtype for name in columns[1:]}
+    dtypes[columns[0]] = "category"
+    return dtypes
+
+def iter_table(in_file, chunk_size=10000, dtype=np.float32, engine='c'):
+    import pandas as pd
+    columns = read_header(in_file)
+    dtypes = column_dtypes(columns, dtype)
+    if engine == 'pyarrow':
+        try:
+            chunks = [pd.read_csv(in_file, sep='\t', dtype=dtypes, engine='pyarrow')]
+        except ImportError:
+            print("pyarrow is not installed -- using the C parser", file=sys.stderr)
+            engine = 'c'
+    if engine != 'pyarrow':
+        chunks = pd.read_csv(in_file, sep='\t', dtype=dtypes, engine=engine, chunksize=chunk_size)
+    for chunk in chunks:
+        data = np.empty((len(chunk), len(columns) - 1), dtype=dtype)
+        for n in range(1, len(columns)):
+            data[:, n-1] = chunk.iloc[:, n].to_numpy()
+        yield chunk.iloc[:, 0].array, data, columns
+
+def count_rows(in_file):
+    count = 0
+    last = b"\n"
+    with open(in_file, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            count += block.count(b"\n")
+            last = block[-1:]
+    return count + (last != b"\n") - 1                    #minus the header line
+
+#Labels that are all numbers are sorted as numbers, the way LabelEncoder would sort them. Labels that are
+#different strings for the same number (1 and 1.0, 01 and 1) are kept apart as strings.
+def sort_numeric_labels(labels):
+    import pandas as pd
+    try:
+        numbers = pd.to_numeric(labels.categories)
+    except (ValueError, TypeError):
+        return labels
+    if not numbers.is_unique:
+        return labels
+    labels = labels.rename_categories(numbers)
+    return labels.reorder_categories(sorted(numbers))
+
+#The whole file goes into one preallocated matrix a chunk at a time, so the peak is the matrix plus one chunk.
+def parse_table(in_file, dtype=np.float32, engine='c', chunk_size=10000):
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+    columns = read_header(in_file)
+    data = np.empty((max(count_rows(in_file), 0), len(columns) - 1), dtype=dtype)
+    label_chunks = []
+    filled = 0
+    for chunk_labels, chunk_data, _ in iter_table(in_file, chunk_size, dtype, engine):
+        if filled + len(chunk_data) > len(data):           #only if the line count was off (e.g. quoted newlines)
+            data = np.concatenate((data[:filled], chunk_data))
+        else:
+            data[filled:filled + len(chunk_data)] = chunk_data
+        filled += len(chunk_data)
+        label_chunks.append(chunk_labels)
+    labels = union_categoricals(label_chunks, sort_categories=True) if label_chunks else pd.Categorical([])
+    labels = sort_numeric_labels(labels)
+    return Labels(labels.codes, labels.categories.to_numpy()), data[:filled], columns
+
+#Peak resident memory of this process so far, in MB (ru_maxrss is in KB on Linux and bytes on macOS).
+def peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+#-----------------------------------------------------------------------------------------------------------
+#Returns (labels, data, columns): labels is a Labels (codes and categories, see above), data a (read-only, memory-mapped when it came
+#from the cache) numeric matrix and columns the header, label column first.
+#-----------------------------------------------------------------------------------------------------------
+def load_table(in_file, use_cache=True, cache_dir=None, max_bytes=None, dtype=np.float32, engine='c'):
+    if not use_cache:
+        return parse_table(in_file, dtype, engine)
+    cache_dir = cache_dir or cache_dir_default()
+    max_bytes = cache_max_bytes_default() if max_bytes is None else max_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(in_file, cache_dir, dtype)
+    entry = load_entry(cache_dir, key)
+    if entry is not None:
+        return entry
+    labels, data, columns = parse_table(in_file, dtype, engine)
+    store_entry(cache_dir, key, labels, data, columns, max_bytes)
+    return labels, data, columns
+
+#For tools that write a table they already hold in memory (e.g. get_kmer_frequencies.py): store it as the cache
+#entry of in_file, so the first load_table of that file is a cache hit instead of a parse. labels are the row
+#labels as written (given sorted categories here, the way parse_table gives them).
+def seed_cache(in_file, labels, data, columns, cache_dir=None, max_bytes=None, dtype=np.float32):
+    import pandas as pd
+    cache_dir = cache_dir or cache_dir_default()
+    max_bytes = cache_max_bytes_default() if max_bytes is None else max_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+    labels = sort_numeric_labels(pd.Categorical(np.asarray(labels, dtype=str)))
+    store_entry(cache_dir, cache_key(in_file, cache_dir, dtype), labels, np.asarray(data, dtype=dtype), columns, max_bytes)
+
+#Group number of every row with the groups numbered in order of first appearance (like pd.factorize).
+def codes_in_order(labels):
+    codes = np.asarray(labels.codes)
+    present, first = np.unique(codes, return_index=True)
+    order = present[np.argsort(first)]
+    remap = np.zeros(len(labels.categories), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return remap[codes], [labels.categories[n] for n in order]
+
+def usage():
+    usage = "\nData Loader\n"
+    usage = usage + "\nUsage: data_loader.py -i <tab delim file>\n       data_loader.py -c\n"
+    usage = usage + "\n-i parses a tab delimited file (column 1 = group, the rest numeric) and stores it in the cache.\n"
+    usage = usage + "-c removes everything from the cache.\n"
+    usage = usage + "-d dtype is the type the data is read into (default = float32)\n"
+    usage = usage + "-e engine is the parser, c (default) or pyarrow\n"
+    usage = usage + "-n parses the file without using the cache (to measure parse time and memory)\n\n"
+    usage = usage + "The cache directory is "+cache_dir_default()+" (set PML_CACHE_DIR to change it)\n"
+    usage = usage + "and is capped at "+str(cache_max_bytes_default())+" bytes (set PML_CACHE_MAX_BYTES to change it).\n\n"
+    return usage
+
+def main(argv):
+    in_file = ""
+    clear = False
+    dtype = 'float32'
+    engine = 'c'
+    use_cache = True
+    try:
+        opts, args = getopt.getopt(argv,"hi:cd:e:n",["ifile=","clear","dtype=","engine=","nocache"])
+    except getopt.GetoptError:
+        print("\nNot a valid argument or value")
+        print(usage())
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage())
+            sys.exit()
+        elif opt in ("-i", "--ifile"):
+            in_file = arg
+        elif opt in ("-c", "--clear"):
+            clear = True
+        elif opt in ("-d", "--dtype"):
+            dtype = arg
+        elif opt in ("-e", "--engine"):
+            engine = arg
+        elif opt in ("-n", "--nocache"):
+            use_cache = False
+    if clear:
+        shutil.rmtree(cache_dir_default(), ignore_errors=True)
+        print("Cache cleared.")
+    if in_file:
+        start = time.time()
+        try:
+            labels, data, columns = load_table(in_file, use_cache, dtype=dtype, engine=engine)
+        except FileNotFoundError:
+            print("\nPlease enter a tab delimited file.")
+            sys.exit(2)
+        except ValueError:
+            print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+            sys.exit(3)
+        print("Loaded "+str(data.shape[0])+" rows x "+str(data.shape[1])+" columns, "+str(len(labels.categories))+" groups in "+str("%.3f" % (time.time() - start))+" seconds.")
+        print("Data = "+str("%.1f" % (data.nbytes / 1024**2))+" MB as "+str(data.dtype)+", peak memory = "+str("%.1f" % peak_memory_mb())+" MB")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+###########################################################################
+### Get K-mer Frequencies                                               ###
+### Usage: get_kmer_frequencies.py -o <out file> <fasta files>          ###
+###                                                                     ###
+### Counts the k-mers (tetranucleotides by default) in each fasta file ###
+### (e.g. one file per MAG) or each record, and writes a tab delimited ###
+### file with the label in column 1 and one column of counts per k-mer, ###
+### the input nn_runner.py and get_pca.py take.                         ###
+###                                                                     ###
+### A k-mer and its reverse complement are counted together (136       ###
+### columns for k = 4) unless -a is given (all 4^k k-mers).             ###
+###########################################################################
+
+import sys, getopt, os, gzip, io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+#A, C, G, T (either case) -> 0, 1, 2, 3; anything else (N, IUPAC codes, gaps) -> 4.
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = code
+    BASE_CODES[base + 32] = code
+FASTA_EXTENSIONS = (".gz", ".fasta", ".fa", ".fna", ".ffn", ".fas")
+MAX_K = 10                        #every count is a 4^k array: 8 MB per record at k = 10, 8 GB at k = 15
+
+def open_fasta(file_name):
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rb")
+    return open(file_name, "rb")
+
+#Yields (name, sequence as bytes) for each record, reading the file a line at a time.
+def iter_fasta(file_name):
+    name = None
+    lines = []
+    with open_fasta(file_name) as fh:
+        for line in fh:
+            if line.startswith(b">"):
+                if name is not None:
+                    yield name, b"".join(lines)
+                header = line[1:].decode(errors="replace").split()
+                name = header[0] if header else ""
+                lines = []
+            else:
+                lines.append(line.strip())
+    if name is not None:
+        yield name, b"".join(lines)
+
+#-----------------------------------------------------------------------------------------------------------------
+#Counting. The sequence is turned into 2 bit codes with one table lookup, and the index of every k-mer is built
+#for all positions at once by shifting in one base at a time (k array operations, no k-mer strings). Windows that
+#contain anything but A, C, G or T are dropped.
+#-----------------------------------------------------------------------------------------------------------------
+def kmer_indices(sequence, k):
+    codes = BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+    num_windows = len(codes) - k + 1
+    if num_windows <= 0:
+        return np.empty(0, dtype=np.int64)
+    index = np.zeros(num_windows, dtype=np.int64)
+    for j in range(k):
+        index = (index << 2) | (codes[j:j + num_windows] & 3)
+    bad = np.concatenate(([0], np.cumsum(codes == 4)))
+    return index[bad[k:] == bad[:num_windows]]
+
+def count_kmers(sequence, k):
+    return np.bincount(kmer_indices(sequence, k), minlength=4**k)
+
+def kmer_name(index, k):
+    return "".join("ACGT"[(index >> 2 * (k - 1 - j)) & 3] for j in range(k))
+
+def reverse_complements(k):
+    index = np.arange(4**k, dtype=np.int64)
+    rc = np.zeros_like(index)
+    for j in range(k):
+        rc = (rc << 2) | (3 - ((index >> 2 * j) & 3))
+    return rc
+
+#Column of every k-mer index (a k-mer and its reverse complement share the column of whichever comes first
+#alphabetically) and the column names. Without canonical, every k-mer has its own column.
+def kmer_columns(k, canonical=True):
+    index = np.arange(4**k, dtype=np.int64)
+    if not canonical:
+        return index, [kmer_name(n, k) for n in index]
+    representative = np.minimum(index, reverse_complements(k))
+    kept, column_of = np.unique(representative, return_inverse=True)
+    return column_of, [kmer_name(n, k) for n in kept]
+
+def fold_counts(counts, column_of, num_columns):
+    return np.bincount(column_of, weights=counts, minlength=num_columns).astype(np.int64)
+
+#-----------------------------------------------------------------------------------------------------------------
+#Worker tasks. count_file sends back one row per file (all its records added up); count_records one row per record.
+#-----------------------------------------------------------------------------------------------------------------
+def file_label(file_name):
+    name = os.path.basename(file_name)
+    while name.lower().endswith(FASTA_EXTENSIONS):
+        name = os.path.splitext(name)[0]
+    return name
+
+def count_file(file_name, k, canonical):
+    column_of, names = kmer_columns(k, canonical)
+    counts = np.zeros(4**k, dtype=np.int64)
+    for _, sequence in iter_fasta(file_name):
+        counts += count_kmers(sequence, k)
+    return [(file_label(file_name), fold_counts(counts, column_of, len(names)))]
+
+def count_records(records, k, canonical):
+    column_of, names = kmer_columns(k, canonical)
+    return [(name, fold_counts(count_kmers(sequence, k), column_of, len(names))) for name, sequence in records]
+
+#Records in batches of about batch_bases bases, so each task is big enough to be worth sending to a worker.
+def iter_record_batches(files, batch_bases=4000000):
+    batch = []
+    size = 0
+    for file_name in files:
+        for record in iter_fasta(file_name):
+            batch.append(record)
+            size += len(record[1])
+            if size >= batch_bases:
+                yield batch
+                batch = []
+                size = 0
+    if batch:
+        yield batch
+
+#Like pool.map, but only max_pending tasks are submitted at a time, so the record batches are read as they are needed.
+def map_bounded(pool, func, tasks, max_pending, *args):
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(func, task, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+#-----------------------------------------------------------------------------------------------------------------
+#Returns (labels, data, columns) like data_loader.load_table, except labels is a plain list of the row labels
+#(file names, or record names with per_record) and data holds the counts (or frequencies with relative).
+#-----------------------------------------------------------------------------------------------------------------
+def kmer_table(files, k=4, canonical=True, per_record=False, procs=None, relative=False, label_map=None):
+    if not 1 <= k <= MAX_K:
+        raise ValueError("k must be from 1 to "+str(MAX_K))
+    procs = max(1, procs or os.cpu_count() or 1)
+    if per_record:
+        tasks, func = iter_record_batches(files), count_records
+    else:
+        tasks, func = files, count_file
+    if procs == 1:
+        results = [func(task, k, canonical) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=procs) as pool:
+            results = list(map_bounded(pool, func, tasks, 2 * procs, k, canonical))
+    rows = [row for result in results for row in result]
+    labels = [label_map.get(name, name) if label_map else name for name, _ in rows]
+    data = np.array([counts for _, counts in rows], dtype=np.int64).reshape(len(rows), -1)
+    if relative:
+        totals = data.sum(axis=1, keepdims=True)
+        data = (data / np.maximum(totals, 1)).astype(np.float32)
+    return labels, data, ["label"] + kmer_columns(k, canonical)[1]
+
+def write_table(out_file, labels, data, columns):
+    fmt = "%d" if data.dtype.kind == "i" else "%.9g"      #9 digits read back as exactly the same float32
+    with open(out_file, "w") as out:
+        out.write("\t".join(columns)+"\n")
+        for start in range(0, len(data), 10000):
+            block = io.StringIO()
+            np.savetxt(block, data[start:start + 10000], fmt=fmt, delimiter="\t")
+            for label, line in zip(labels[start:start + 10000], block.getvalue().splitlines()):
+                out.write(str(label)+"\t"+line+"\n")
+
+#Two column tab delimited file: file or record name, group.
+def read_label_map(file_name):
+    label_map = {}
+    with open(file_name) as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 2:
+                label_map[fields[0]] = fields[1]
+    return label_map
+
+def usage():
+    usage = "\nGet K-mer Frequencies\n"
+    usage = usage + "\nUsage: get_kmer_frequencies.py -o <out file> <fasta files>\n"
+    usage = usage + "\nCounts the k-mers in each fasta file (or .gz) and writes one row per file: the file name\n"
+    usage = usage + "(or its group, see -l) and the count of each k-mer, ready for nn_runner.py and get_pca.py.\n\n"
+    usage = usage + "  -i file          a fasta file (can be repeated; files can also be listed after the options)\n"
+    usage = usage + "  -k k             k-mer length, 1 to "+str(MAX_K)+" (default = 4, tetranucleotides)\n"
+    usage = usage + "  -a               count all 4^k k-mers instead of adding each k-mer to its reverse complement\n"
+    usage = usage + "  -R               one row per record instead of one row per file\n"
+    usage = usage + "  -r               relative frequencies (each row divided by its total) instead of counts\n"
+    usage = usage + "  -l labels_file   tab delimited file of file (or record) names and groups, to label rows by group\n"
+    usage = usage + "  -p procs         number of worker processes (default = number of cores)\n"
+    usage = usage + "  -o out_file      tab delimited output file (default = kmer_frequencies.tsv)\n"
+    usage = usage + "  -c               also put the table in the data_loader.py cache, so the first\n"
+    usage = usage + "                   nn_runner.py or get_pca.py run on out_file does not have to parse it\n\n"
+    return usage
+
+def main(argv):
+    #---------------------------
+    #Read command line arguments
+    #---------------------------
+    files = []
+    k = 4
+    canonical = True
+    per_record = False
+    relative = False
+    labels_file = ""
+    procs = os.cpu_count() or 1
+    out_file = "kmer_frequencies.tsv"
+    seed = False
+    try:
+        opts, args = getopt.getopt(argv,"hi:k:aRrl:p:o:c",["ifile=","kmer=","all","records","relative","labels=","procs=","ofile=","cache"])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(usage())
+                sys.exit()
+            elif opt in ("-i", "--ifile"):
+                files.append(arg)
+            elif opt in ("-k", "--kmer"):
+                k = int(arg)
+            elif opt in ("-a", "--all"):
+                canonical = False
+            elif opt in ("-R", "--records"):
+                per_record = True
+            elif opt in ("-r", "--relative"):
+                relative = True
+            elif opt in ("-l", "--labels"):
+                labels_file = arg
+            elif opt in ("-p", "--procs"):
+                procs = int(arg)
+            elif opt in ("-o", "--ofile"):
+                out_file = arg
+            elif opt in ("-c", "--cache"):
+                seed = True
+    except (getopt.GetoptError, ValueError):
+        print("\nNot a valid argument or value")
+        print(usage())
+        sys.exit(2)
+    files += args
+    if not files or not (1 <= k <= MAX_K):
+        print("\nGive at least one fasta file, and k from 1 to "+str(MAX_K)+".")
+        print(usage())
+        sys.exit(2)
+
+    #------------------------------
+    #Count the k-mers and write them
+    #------------------------------
+    try:
+        label_map = read_label_map(labels_file) if labels_file else None
+        labels, data, columns = kmer_table(files, k, canonical, per_record, procs, relative, label_map)
+    except FileNotFoundError as err:
+        print("\nNot a valid argument or value -- File Not Found Error: "+str(err.filename))
+        sys.exit(3)
+    write_table(out_file, labels, data, columns)
+    print(str(len(labels))+" rows x "+str(len(columns) - 1)+" k-mers written to "+out_file)
+    if seed:
+        from data_loader import seed_cache
+        seed_cache(out_file, labels, data, columns)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
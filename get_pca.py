@@ -11,11 +11,113 @@
 ### 04/08/2022                                                        ###
 #########################################################################
 
-import sys, getopt
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from sklearn.decomposition import PCA
+import sys, getopt, json
+import numpy as np
+from data_loader import load_table, iter_table, codes_in_order, peak_memory_mb
+
+COLORS = ['red','green','orange','blue','yellow','purple','pink','turquoise']
+SOLVERS = ['auto','full','arpack','randomized']
+
+#--------------------------------------------------------------------------------------------------------------
+#One PCA fit gives both the coordinates and the percent of variance explained by each component. With the
+#randomized or arpack (truncated) solvers the cost grows with the number of components asked for, not with the
+#number of columns. Returns (coordinates, percent variance explained per component, fitted PCA).
+#--------------------------------------------------------------------------------------------------------------
+def fit_pca(data, n_components=2, solver='auto', random_state=None):
+    from sklearn.decomposition import PCA
+    pca = PCA(n_components=n_components, svd_solver=solver, random_state=random_state)
+    coords = pca.fit_transform(data)
+    return coords, pca.explained_variance_ratio_*100, pca
+
+#Standardize the columns (mean 0, variance 1) and then fit_pca. Returns (coordinates, percents, scaler, pca);
+#scaler.transform then pca.transform gives the coordinates of new rows (this is nn_runner.py's --pca stage).
+def fit_scaled_pca(data, n_components=2, solver='auto', random_state=None):
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    coords, percents, pca = fit_pca(scaler.fit_transform(data), n_components, solver, random_state)
+    return coords, percents, scaler, pca
+
+#--------------------------------------------------------------------
+#Put the groups (in order of appearance) in a dictionary with colors
+#--------------------------------------------------------------------
+def assign_colors(uniques):
+    groups = {}
+    i = 0
+    for item in uniques:
+        groups[item] = COLORS[i]
+        print("item = "+str(item)+" colr = "+COLORS[i])
+        i+=1
+        if i >= len(COLORS):
+            print("Warning: More than "+str(len(COLORS))+" groups -- colors will be duplicated")
+            i = 0
+    print("Number of groups found = "+str(len(groups)))
+    return groups
+
+#--------------------------------------------------------------------------------------------------------------
+#Out-of-core PCA for files larger than memory. The first pass reads the file chunk_size rows at a time and fits
+#an IncrementalPCA with partial_fit; the second pass transforms each chunk and writes the PC coordinates to
+#pcs_file as it goes. All that is kept is the row count of each group and, with keep_points (for the plot), the
+#group code and first two PC coordinates of every row; otherwise codes and coords come back as None.
+#--------------------------------------------------------------------------------------------------------------
+def streaming_pca(in_file, chunk_size, pcs_file, n_components=2, dtype=np.float32, engine='c', keep_points=True):
+    import pandas as pd
+    from sklearn.decomposition import IncrementalPCA
+    chunk_size = max(chunk_size, n_components)
+    ipca = IncrementalPCA(n_components=n_components)
+    pending = None
+    for _, nums, _ in iter_table(in_file, chunk_size, dtype, engine):
+        if pending is not None:
+            if len(nums) < n_components:                   #a short last chunk is fitted together with the one before
+                nums = np.vstack((pending, nums))
+            else:
+                ipca.partial_fit(pending)
+        pending = nums
+    ipca.partial_fit(pending)
+
+    labels = {}
+    counts = np.zeros(0, dtype=np.int64)
+    codes = []
+    coords = []
+    pc_names = ["PC"+str(n+1) for n in range(n_components)]
+    with open(pcs_file, "w") as out:
+        for k, (chunk_labels, nums, columns) in enumerate(iter_table(in_file, chunk_size, dtype, engine)):
+            pcs = ipca.transform(nums)
+            local_codes, local_uniques = pd.factorize(chunk_labels)
+            global_codes = np.array([labels.setdefault(item, len(labels)) for item in local_uniques], dtype=np.int32)
+            chunk_codes = global_codes[local_codes]
+            counts = np.concatenate((counts, np.zeros(len(labels) - len(counts), dtype=np.int64)))
+            counts += np.bincount(chunk_codes, minlength=len(labels))
+            if keep_points:
+                codes.append(chunk_codes)
+                coords.append(pcs[:, :2].astype(np.float32))
+            pcs_df = pd.DataFrame(pcs, columns=pc_names)
+            pcs_df.insert(0, columns[0], np.asarray(chunk_labels))
+            pcs_df.to_csv(out, sep='\t', index=False, header=(k == 0), float_format="%.6g")
+    if not keep_points:
+        return None, list(labels), None, counts, ipca.explained_variance_ratio_
+    return np.concatenate(codes), list(labels), np.concatenate(coords), counts, ipca.explained_variance_ratio_
+
+#--------------------------------------------------------------------------------------------------------------
+#Density view for very large files: the points of each group are binned onto one grid, each pixel gets the
+#average color of the groups in it and an opacity from the log of its count, and the whole thing is drawn as a
+#single image. Plot time and png size stay the same no matter how many rows there are.
+#--------------------------------------------------------------------------------------------------------------
+def density_image(x, y, codes, colors, bins=400):
+    import matplotlib.colors as mcolors
+    x_edges = np.linspace(x.min(), x.max(), bins + 1)
+    y_edges = np.linspace(y.min(), y.max(), bins + 1)
+    rgb = np.zeros((bins, bins, 3))
+    total = np.zeros((bins, bins))
+    for code, color in enumerate(colors):
+        mask = codes == code
+        counts = np.histogram2d(y[mask], x[mask], bins=[y_edges, x_edges])[0]
+        rgb += counts[:, :, None] * np.array(mcolors.to_rgb(color))[None, None, :]
+        total += counts
+    image = np.zeros((bins, bins, 4))
+    filled = total > 0
+    image[filled, :3] = rgb[filled] / total[filled, None]
+    image[:, :, 3] = np.log1p(total) / np.log1p(total.max())
+    return image, (x_edges[0], x_edges[-1], y_edges[0], y_edges[-1])
 
 def usage ():
     usage = "\nGet PCA\n"
@@ -23,7 +125,19 @@ def usage ():
     usage = usage + "\nThis program reads a tab delimited file where,\n"
     usage = usage + "Column 1 = Group, and the rest of the columns are data points.\nFirst row should contain headers (not data).\n"
     usage = usage + "Colors will be duplicated if there are more than eight groups.\n\n"
-    usage = usage + "-o out_file_name is optional (default = pca_image), .png will be appended to the name\n\n"
+    usage = usage + "-o out_file_name is optional (default = pca_image), .png will be appended to the name\n"
+    usage = usage + "-d draws a density image instead of one point per row (for very large files)\n"
+    usage = usage + "-b bins is the number of bins across each axis of the density image (default = 400)\n"
+    usage = usage + "-c chunk_size reads the file chunk_size rows at a time and fits an IncrementalPCA, for files larger\n"
+    usage = usage + "than memory. The PC coordinates are also written to out_file_name_pcs.tsv\n"
+    usage = usage + "-n n_components is the number of components to calculate (default = 2). The plot always shows the\n"
+    usage = usage + "first two; with more than two the PC coordinates are written to out_file_name_pcs.tsv\n"
+    usage = usage + "-s solver is the PCA solver: auto, full, arpack (truncated) or randomized (default = auto)\n"
+    usage = usage + "--nocache parses the file again instead of reading it from the cache (see data_loader.py)\n"
+    usage = usage + "--dtype=type is the type the data is read into (default = float32)\n"
+    usage = usage + "--engine=name is the parser, c (default) or pyarrow\n"
+    usage = usage + "--no-plot skips the plot (and matplotlib) and writes the results to the screen as JSON\n"
+    usage = usage + "(all other messages go to stderr)\n\n"
     usage = usage + "It returns a PCA plot (in .png file) of the first two principle components of the data\n\n"
     usage = usage + "Jennifer Meneghin\n"
     usage = usage + "April 8, 2022\n\n"
@@ -35,8 +149,17 @@ def main(argv):
     #---------------------------
     in_file = ""
     out_file = "pca_image"
+    density = False
+    bins = 400
+    chunk_size = 0
+    n_components = 2
+    solver = 'auto'
+    use_cache = True
+    dtype = 'float32'
+    engine = 'c'
+    plot = True
     try:
-        opts, args = getopt.getopt(argv,"hi:o:",["ifile=","ofile="])
+        opts, args = getopt.getopt(argv,"hi:o:db:c:n:s:",["ifile=","ofile=","density","bins=","chunksize=","ncomponents=","solver=","nocache","dtype=","engine=","no-plot"])
     except getopt.GetoptError:
         print("\nNot a valid argument or value")
         print(usage())
@@ -49,72 +172,122 @@ def main(argv):
             in_file = arg
         elif opt in ("-o", "--ofile"):
             out_file = arg
+        elif opt in ("-d", "--density"):
+            density = True
+        elif opt in ("-b", "--bins"):
+            bins = int(arg)
+        elif opt in ("-c", "--chunksize"):
+            chunk_size = int(arg)
+        elif opt in ("-n", "--ncomponents"):
+            n_components = int(arg)
+        elif opt in ("-s", "--solver"):
+            solver = arg
+        elif opt == "--nocache":
+            use_cache = False
+        elif opt == "--dtype":
+            dtype = arg
+        elif opt == "--engine":
+            engine = arg
+        elif opt == "--no-plot":
+            plot = False
+    if n_components < 2 or not(solver in SOLVERS):
+        print("\nThe number of components must be at least 2 and the solver one of "+", ".join(SOLVERS))
+        print(usage())
+        sys.exit(2)
+    results_out = sys.stdout
+    if not plot:
+        sys.stdout = sys.stderr                            #messages to stderr, only the JSON results to stdout
 
-    #---------------------
-    #Open File for reading
-    #---------------------
-    try:
-        df = pd.read_csv(in_file,sep='\t')
+    #--------------------------------------------------------
+    #Streaming mode: fit and transform the file chunk by chunk
+    #--------------------------------------------------------
+    if chunk_size > 0:
         print("\nParameters:\ndata file = "+in_file)
         print("output file = "+out_file+".png")
-    except FileNotFoundError:
-        print("\nPlease enter a tab delimited file.")
-        print(usage())
-        sys.exit(2)
+        print("Calculating PCA "+str(chunk_size)+" rows at a time...")
+        try:
+            codes, uniques, bnt, counts, ratios = streaming_pca(in_file, chunk_size, out_file+"_pcs.tsv", n_components, dtype, engine, keep_points=plot)
+        except FileNotFoundError:
+            print("\nPlease enter a tab delimited file.")
+            print(usage())
+            sys.exit(2)
+        except ValueError:
+            print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+            sys.exit(3)
+        print("PC coordinates written to "+out_file+"_pcs.tsv")
+        groups = assign_colors(uniques)
+        percents = ratios*100
+    else:
+        #---------------------
+        #Open File for reading (parsed once, then read from the cache)
+        #---------------------
+        try:
+            labels, bignums, columns = load_table(in_file, use_cache, dtype=dtype, engine=engine)
+            print("\nParameters:\ndata file = "+in_file)
+            print("output file = "+out_file+".png")
+            print("Peak memory after loading = "+str("%.1f" % peak_memory_mb())+" MB")
+        except FileNotFoundError:
+            print("\nPlease enter a tab delimited file.")
+            print(usage())
+            sys.exit(2)
+        except ValueError:
+            print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+            sys.exit(3)
 
-    #--------------------------------------------------------------------
-    #Get the First Column from the File and Put in Dictionary with Colors
-    #--------------------------------------------------------------------
-    colors = ['red','green','orange','blue','yellow','purple','pink','turquoise']
-    groups = {}
-    bigarray = df.to_numpy()
-    i = 0
-    for item in bigarray[:,0]:
-        if not(item in groups):
-            groups[item] = colors[i]
-            print("item = "+item+" colr = "+colors[i])
-            i+=1
-            if i >= len(colors):
-                print("Warning: More than "+str(len(colors))+" groups -- colors will be duplicated")
-                i = 0
-    print("Number of groups found = "+str(len(groups)))
+        #--------------------------------------------------------------------
+        #Get the First Column from the File and Put in Dictionary with Colors
+        #--------------------------------------------------------------------
+        codes, uniques = codes_in_order(labels)           #group number of every row, groups in order of appearance
+        counts = np.bincount(codes, minlength=len(uniques))
+        groups = assign_colors(uniques)
+
+        #-------------
+        #Calculate PCA
+        #-------------
+        print("Calculating PCA ("+solver+" solver, "+str(n_components)+" components)...")
+        try:
+            bnt, percents, pca = fit_pca(bignums, n_components, solver)
+        except ValueError as err:
+            print("\n"+str(err)+"\n")
+            sys.exit(3)
+        if n_components > 2:
+            import pandas as pd
+            pcs_df = pd.DataFrame(bnt, columns=["PC"+str(n+1) for n in range(n_components)])
+            pcs_df.insert(0, columns[0], np.asarray(labels))
+            pcs_df.to_csv(out_file+"_pcs.tsv", sep='\t', index=False, float_format="%.6g")
+            print("PC coordinates written to "+out_file+"_pcs.tsv")
+    for n in range(len(percents)):
+        print("Variance explained by PC"+str(n+1)+" = "+str("%.2f" % percents[n])+"%")
+    petotal = percents[0] + percents[1]
+    if not plot:
+        results = {"file": in_file, "rows": int(counts.sum()), "n_components": n_components, "solver": solver,
+                   "variance_explained_percent": [float(p) for p in percents],
+                   "groups": {str(item): int(count) for item, count in zip(uniques, counts)}}
+        if chunk_size > 0 or n_components > 2:
+            results["pcs_file"] = out_file+"_pcs.tsv"
+        print(json.dumps(results), file=results_out)
+        return
 
-    #-------------
-    #Calculate PCA
-    #-------------
-    print("Calculating PCA...")
-    pca = PCA(n_components=2)
-    bignums = bigarray[:,1:]
-    try:
-        pca.fit(bignums)
-    except ValueError:
-        print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
-        sys.exit(3)                
-    bnt = pca.transform(bignums)
-    df_pca = pd.DataFrame(bnt.T, index=['PC1','PC2'])
-    
     #----------------------------------
     #Display PCA (first two components)
     #----------------------------------
     print("Displaying PCA...")
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
     fig = plt.figure()
     ax1 = fig.add_subplot(111)
     my_patches = []
-    i = 0
-    print("Number of data points found = "+str(len(df_pca.T)))
-    while i < len(df_pca.T):
-        ax1.scatter(df_pca[i].loc['PC1'],df_pca[i].loc['PC2'],c=groups[bigarray[i,0]])
-        i +=1
-        pc = ((100*i)/len(df_pca.T))
-        if i % 1000 == 0:
-            print("Percent Complete = %.2f" % pc)
+    print("Number of data points found = "+str(len(bnt)))
+    if density:
+        image, extent = density_image(bnt[:,0], bnt[:,1], codes, list(groups.values()), bins)
+        ax1.imshow(image, extent=extent, origin='lower', aspect='auto', interpolation='nearest')
+    else:
+        for code, item in enumerate(uniques):            #one scatter call per group
+            mask = codes == code
+            ax1.scatter(bnt[mask,0], bnt[mask,1], c=groups[item], rasterized=True)
     for item in groups:
         my_patches.append(mpatches.Patch(color=groups[item], label=item))
     lgd = ax1.legend(handles=my_patches,loc='center right', bbox_to_anchor=(2.0,0.5))
-    pcatotal = PCA().fit(bignums)
-    pepc1 = pcatotal.explained_variance_ratio_[0]
-    pepc2 = pcatotal.explained_variance_ratio_[1]
-    petotal = (pepc1 + pepc2)*100
     ax1.set_title('Two Dimensional PCA of '+in_file+'\n(Variance Explained = '+str("%.2f" % petotal)+"%)")
     ax1.set_xlabel("PC 1")
     ax1.set_ylabel("PC 2")
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+##########################################################################################
+### Evaluation metrics for nn_runner.py                                                ###
+###                                                                                    ###
+### Per-group precision, recall (the per-group accuracy nn_runner_withbarplot.py      ###
+### plots) and F1, plus the overall accuracy, straight from the predictions. The       ###
+### bootstrap confidence intervals resample the test set thousands of times at once:  ###
+### one matrix of row indices per block of resamples, and one bincount call counts    ###
+### the confusion matrices of the whole block.                                         ###
+##########################################################################################
+
+import warnings
+import numpy as np
+
+METRICS = ("precision", "recall", "f1")
+
+#Group names -> numbers 0..len(classes)-1 (classes must be sorted, e.g. from np.unique).
+def encode(y, classes):
+    return np.searchsorted(classes, np.asarray(y))
+
+#-----------------------------------------------------------------------------------------------------
+#Confusion matrices laid out like nn_runner.py's: rows = predicted group, columns = actual group.
+#pairs holds predicted * num_classes + actual for each row; pairs[..., n] of any shape (..., n) gives
+#matrices of shape (..., num_classes, num_classes).
+#-----------------------------------------------------------------------------------------------------
+def pair_codes(y_true, y_pred, num_classes):
+    return np.asarray(y_pred, dtype=np.int64) * num_classes + np.asarray(y_true, dtype=np.int64)
+
+def confusion_counts(pairs, num_classes):
+    pairs = np.asarray(pairs)
+    cells = num_classes * num_classes
+    blocks = int(np.prod(pairs.shape[:-1], dtype=np.int64))
+    offsets = (np.arange(blocks, dtype=np.int64) * cells).reshape(pairs.shape[:-1] + (1,))
+    counts = np.bincount((pairs + offsets).ravel(), minlength=blocks * cells)
+    return counts.reshape(pairs.shape[:-1] + (num_classes, num_classes))
+
+#(actual, predicted) for each row counted in a confusion matrix -- for when only the matrix was kept.
+def labels_from_counts(cm):
+    cm = np.asarray(cm)
+    predicted, actual = np.divmod(np.repeat(np.arange(cm.size), cm.ravel()), cm.shape[1])
+    return actual, predicted
+
+#Scores of one confusion matrix or a stack of them. Groups never predicted (or never present) get NaN.
+def scores_from_counts(cm):
+    cm = np.asarray(cm, dtype=np.float64)
+    correct = np.diagonal(cm, axis1=-2, axis2=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = correct / cm.sum(axis=-1)
+        recall = correct / cm.sum(axis=-2)
+        f1 = 2 * precision * recall / (precision + recall)
+        accuracy = correct.sum(axis=-1) / cm.sum(axis=(-2, -1))
+    return {"precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy}
+
+def classification_metrics(y_true, y_pred, num_classes=None):
+    if num_classes is None:
+        num_classes = int(max(np.max(y_true), np.max(y_pred))) + 1
+    cm = confusion_counts(pair_codes(y_true, y_pred, num_classes), num_classes)
+    return dict(scores_from_counts(cm), cm=cm)
+
+#-----------------------------------------------------------------------------------------------------
+#Percentile bootstrap. The resamples are done block_size at a time so the index matrix stays around
+#max_cells entries however big the test set is. Returns (low, high) arrays for every metric.
+#-----------------------------------------------------------------------------------------------------
+def bootstrap_metrics(y_true, y_pred, num_classes=None, resamples=1000, confidence=0.95, seed=0, max_cells=10000000):
+    if num_classes is None:
+        num_classes = int(max(np.max(y_true), np.max(y_pred))) + 1
+    pairs = pair_codes(y_true, y_pred, num_classes)
+    rng = np.random.default_rng(seed)
+    block_size = max(1, min(resamples, max_cells // max(len(pairs), 1)))
+    scores = {name: [] for name in METRICS + ("accuracy",)}
+    for start in range(0, resamples, block_size):
+        rows = rng.integers(0, len(pairs), (min(block_size, resamples - start), len(pairs)))
+        block = scores_from_counts(confusion_counts(pairs[rows], num_classes))
+        for name in scores:
+            scores[name].append(block[name])
+    tails = [50 * (1 - confidence), 50 * (1 + confidence)]
+    intervals = {"confidence": confidence}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)     #all-NaN groups (never predicted) stay NaN
+        for name, values in scores.items():
+            low, high = np.nanpercentile(np.concatenate(values), tails, axis=0)
+            intervals[name] = (low, high)
+    return intervals
+
+def print_report(names, metrics, intervals=None):
+    print(str("%-20s" % "Group")+"".join(str("%-24s" % name.capitalize()) for name in METRICS))
+    for n, name in enumerate(names):
+        line = str("%-20s" % str(name)[:19])
+        for metric in METRICS:
+            value = str("%.4f" % metrics[metric][n])
+            if intervals is not None:
+                value += " ("+str("%.3f" % intervals[metric][0][n])+"-"+str("%.3f" % intervals[metric][1][n])+")"
+            line += str("%-24s" % value)
+        print(line)
+    line = "Accuracy = "+str("%.4f" % metrics["accuracy"])
+    if intervals is not None:
+        line += " ("+str("%.4f" % intervals["accuracy"][0])+"-"+str("%.4f" % intervals["accuracy"][1])+", bootstrap "+str("%g" % (100 * intervals["confidence"]))+"% CI)"
+    print(line)
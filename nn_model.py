@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+##########################################################################################
+### Model persistence for nn_runner.py                                                 ###
+###                                                                                    ###
+### save_model writes a fitted classifier to disk together with its label encoder     ###
+### (group names <-> numbers) and the column schema it was trained on. predict_file   ###
+### loads nothing but that file and classifies a tab delimited file of any size a     ###
+### chunk at a time, streaming the predictions and class probabilities to disk.       ###
+##########################################################################################
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+from data_loader import read_header, iter_table
+
+MODEL_VERSION = 1
+
+def save_model(model_file, classifier, categories, columns, dtype="float32"):
+    label_encoder = LabelEncoder()
+    label_encoder.classes_ = np.asarray(list(categories))
+    joblib.dump({"version": MODEL_VERSION, "classifier": classifier, "label_encoder": label_encoder,
+                 "columns": list(columns), "dtype": str(dtype)}, model_file)
+
+def load_model(model_file):
+    model = joblib.load(model_file)
+    if not isinstance(model, dict) or model.get("version") != MODEL_VERSION:
+        raise ValueError(model_file+" is not a model saved by nn_runner.py")
+    return model
+
+#Where each of the model's columns is in the new file (None if they are already in the same order).
+def column_order(model_columns, columns):
+    if list(columns) == list(model_columns):
+        return None
+    missing = [name for name in model_columns if name not in columns]
+    if missing:
+        raise ValueError("Columns missing from the input file: "+", ".join(map(str, missing[:10])))
+    position = {name: n for n, name in enumerate(columns)}
+    return np.array([position[name] for name in model_columns])
+
+#-----------------------------------------------------------------------------------------------------
+#Batch prediction. The first column of in_file is an identifier (e.g. the MAG name) and is copied to the
+#output, followed by the predicted group and the probability of each group. Returns the number of rows.
+#-----------------------------------------------------------------------------------------------------
+def predict_file(model, in_file, out_file, chunk_size=10000, engine='c'):
+    columns = read_header(in_file)
+    order = column_order(model["columns"], columns[1:])
+    classifier = model["classifier"]
+    classes = model["label_encoder"].inverse_transform(classifier.classes_)
+    prob_names = ["prob_"+str(name) for name in classes]
+    rows = 0
+    with open(out_file, "w") as out:
+        out.write("\t".join([str(columns[0]), "predicted"] + prob_names)+"\n")
+        for ids, data, _ in iter_table(in_file, chunk_size, model["dtype"], engine):
+            if order is not None:
+                data = data[:, order]
+            probabilities = classifier.predict_proba(data)
+            predictions = pd.DataFrame(probabilities, columns=prob_names)
+            predictions.insert(0, "predicted", classes[probabilities.argmax(axis=1)])
+            predictions.insert(0, columns[0], np.asarray(ids))
+            predictions.to_csv(out, sep='\t', header=False, index=False, float_format="%.6g")
+            rows += len(data)
+    return rows
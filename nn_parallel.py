@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+##########################################################################################
+### Parallel helpers for nn_runner.py                                                  ###
+###                                                                                    ###
+### The data is loaded and split once in the main process and copied into shared      ###
+### memory. Worker processes attach to it by name, so each task only sends its         ###
+### parameters instead of pickling the whole training set into every task.            ###
+###                                                                                    ###
+### run_sweep trains one MLPClassifier per set of parameters (a grid or a random       ###
+### sample of a grid), as many at a time as there are cores, and ranks them.           ###
+### run_cv fits the folds of a (repeated) k-fold cross-validation the same way.        ###
+##########################################################################################
+
+import os, time, itertools, random, json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+#-----------------------------------------------------------------------------------------------------
+#Shared memory. share_arrays copies each array into its own block once and returns the blocks (to be
+#released by the main process) and a small spec that is sent to the workers instead of the data.
+#-----------------------------------------------------------------------------------------------------
+SHARED = {}
+_BLOCKS = []
+
+def share_arrays(arrays):
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def release_arrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def attach_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)   #Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+#Pool initializer: attach to the shared arrays, and use one BLAS thread per worker (the pool is the parallelism).
+def attach_arrays(specs):
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    for name, (block_name, shape, dtype) in specs.items():
+        block = attach_block(block_name)
+        _BLOCKS.append(block)
+        SHARED[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+def run_shared(task, args_list, arrays, procs=None):
+    procs = max(1, min(procs or available_cores(), len(args_list)))
+    blocks, specs = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=procs, initializer=attach_arrays, initargs=(specs,)) as pool:
+            return list(pool.map(task, *zip(*args_list)))
+    finally:
+        release_arrays(blocks)
+
+#-----------------------------------------------------------------------------------------------------
+#Hyperparameter sweep. The spec is a JSON file mapping MLPClassifier parameters to lists of values, e.g.
+#  {"activation": ["relu", "tanh"], "hidden_layer_sizes": [[100], [150, 100, 50]], "max_iter": [200, 300]}
+#Every combination is tried, or num_random of them picked at random.
+#-----------------------------------------------------------------------------------------------------
+def read_spec(spec_file):
+    with open(spec_file) as fh:
+        spec = json.load(fh)
+    for name, values in spec.items():
+        if not isinstance(values, list):
+            spec[name] = values = [values]
+        spec[name] = [tuple(v) if isinstance(v, list) else v for v in values]
+    return spec
+
+def expand_grid(spec, num_random=0, seed=None):
+    names = list(spec)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[spec[n] for n in names])]
+    if 0 < num_random < len(grid):
+        grid = random.Random(seed).sample(grid, num_random)
+    return grid
+
+def fit_candidate(params, make_classifier):
+    X_train, Y_train = SHARED["X_train"], SHARED["Y_train"]
+    X_test, Y_test = SHARED["X_test"], SHARED["Y_test"]
+    classifier = make_classifier(**dict(params, verbose=False))
+    start = time.time()
+    classifier.fit(X_train, Y_train)
+    fit_time = time.time() - start
+    accuracy = float(np.mean(classifier.predict(X_test) == Y_test))
+    return {"params": params, "accuracy": accuracy, "fit_time": fit_time, "n_iter": int(classifier.n_iter_)}
+
+def run_sweep(X_train, Y_train, X_test, Y_test, candidates, make_classifier, procs=None):
+    arrays = {"X_train": X_train, "Y_train": Y_train, "X_test": X_test, "Y_test": Y_test}
+    results = run_shared(fit_candidate, [(params, make_classifier) for params in candidates], arrays, procs)
+    results.sort(key=lambda r: (-r["accuracy"], r["fit_time"]))
+    return results
+
+def write_sweep_results(results, out_file):
+    names = []
+    for result in results:
+        names += [n for n in result["params"] if n not in names]
+    with open(out_file, "w") as out:
+        out.write("rank\taccuracy\tfit_time\tn_iter\t"+"\t".join(names)+"\n")
+        for rank, result in enumerate(results, 1):
+            values = [str(result["params"].get(n, "")) for n in names]
+            out.write(str(rank)+"\t"+str("%.4f" % result["accuracy"])+"\t"+str("%.2f" % result["fit_time"])+"\t"+str(result["n_iter"])+"\t"+"\t".join(values)+"\n")
+
+#-----------------------------------------------------------------------------------------------------
+#Cross-validation. Every (repeat, fold) is one task; the worker rebuilds its own train/test indices from
+#the shared answers and the seed, so only a few numbers are sent per task. Folds are stratified by default.
+#The confusion matrices are laid out like nn_runner.py's: rows = predicted group, columns = actual group.
+#-----------------------------------------------------------------------------------------------------
+def fold_indices(answers, folds, repeat, fold, seed, stratified):
+    from sklearn.model_selection import KFold, StratifiedKFold
+    if stratified:
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed + repeat)
+    else:
+        splitter = KFold(n_splits=folds, shuffle=True, random_state=seed + repeat)
+    return list(splitter.split(np.zeros(len(answers)), answers))[fold]
+
+def fit_fold(repeat, fold, folds, seed, stratified, num_classes, make_classifier, params):
+    from sklearn.metrics import confusion_matrix
+    data, answers = SHARED["data"], SHARED["answers"]
+    train_idx, test_idx = fold_indices(answers, folds, repeat, fold, seed, stratified)
+    classifier = make_classifier(**dict(params, verbose=False))
+    start = time.time()
+    classifier.fit(data[train_idx], answers[train_idx])
+    fit_time = time.time() - start
+    cm = confusion_matrix(classifier.predict(data[test_idx]), answers[test_idx], labels=np.arange(num_classes))
+    return {"repeat": repeat, "fold": fold, "cm": cm, "accuracy": cm.trace() / cm.sum(), "fit_time": fit_time}
+
+#Correct / column total for each group (the per-group accuracies nn_runner_withbarplot.py plots).
+def class_accuracies(cm):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.diag(cm) / cm.sum(axis=0)
+
+def run_cv(data, answers, make_classifier, folds=5, repeats=1, stratified=True, procs=None, seed=21, params=None):
+    num_classes = int(answers.max()) + 1
+    tasks = [(r, k, folds, seed, stratified, num_classes, make_classifier, params or {}) for r in range(repeats) for k in range(folds)]
+    results = run_shared(fit_fold, tasks, {"data": data, "answers": answers}, procs)
+    total = sum(result["cm"] for result in results)
+    per_class = np.array([class_accuracies(result["cm"]) for result in results])
+    scores = np.array([result["accuracy"] for result in results])
+    return {"folds": results, "cm": total, "accuracy": scores.mean(), "accuracy_std": scores.std(),
+            "class_accuracy": np.nanmean(per_class, axis=0), "class_accuracy_std": np.nanstd(per_class, axis=0)}
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+##########################################################################################
+### Instrumentation for nn_runner.py                                                   ###
+###                                                                                    ###
+### A Profiler records the wall time and peak memory (RSS) of each stage of a run      ###
+### (loading, encoding, splitting, fitting, predicting) and the loss, duration and     ###
+### throughput of every training epoch, and writes them to a JSON or CSV file so runs ###
+### on different versions and data sets can be compared. fit_epochs trains an          ###
+### MLPClassifier one epoch at a time with partial_fit so the epochs can be timed.     ###
+##########################################################################################
+
+import time, json, csv, platform, cProfile
+from contextlib import contextmanager
+import numpy as np
+from data_loader import peak_memory_mb
+
+class Profiler:
+    def __init__(self):
+        self.stages = []
+        self.epochs = []
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name, "seconds": time.perf_counter() - start, "peak_rss_mb": peak_memory_mb()})
+
+    def epoch(self, loss, seconds, samples):
+        self.epochs.append({"epoch": len(self.epochs) + 1, "loss": float(loss), "seconds": seconds,
+                            "samples": int(samples), "samples_per_sec": samples / seconds if seconds > 0 else 0.0})
+
+    def summary(self):
+        return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "python": platform.python_version(), "host": platform.node(),
+                "peak_rss_mb": peak_memory_mb(), "stages": self.stages, "epochs": self.epochs}
+
+    #A .json file gets everything; anything else is written as CSV, one row per stage and per epoch.
+    def write(self, out_file):
+        if out_file.endswith(".json"):
+            with open(out_file, "w") as out:
+                json.dump(self.summary(), out, indent=2)
+            return
+        names = ["kind", "name", "seconds", "peak_rss_mb", "loss", "samples", "samples_per_sec"]
+        with open(out_file, "w", newline="") as out:
+            writer = csv.DictWriter(out, names, delimiter="," if out_file.endswith(".csv") else "\t")
+            writer.writeheader()
+            for stage in self.stages:
+                writer.writerow({"kind": "stage", "name": stage["stage"], "seconds": "%.6f" % stage["seconds"], "peak_rss_mb": "%.1f" % stage["peak_rss_mb"]})
+            for epoch in self.epochs:
+                writer.writerow({"kind": "epoch", "name": epoch["epoch"], "seconds": "%.6f" % epoch["seconds"], "loss": "%.8f" % epoch["loss"],
+                                 "samples": epoch["samples"], "samples_per_sec": "%.1f" % epoch["samples_per_sec"]})
+
+    def report(self):
+        for stage in self.stages:
+            print(str("%-10s" % stage["stage"])+str("%10.3f" % stage["seconds"])+" s  peak RSS = "+str("%.1f" % stage["peak_rss_mb"])+" MB")
+        if self.epochs:
+            rates = [epoch["samples_per_sec"] for epoch in self.epochs]
+            print(str(len(self.epochs))+" epochs, mean throughput = "+str("%.0f" % np.mean(rates))+" samples/sec")
+
+#-----------------------------------------------------------------------------------------------------
+#MLPClassifier.fit one epoch at a time. Each partial_fit call is one pass over X (shuffled, in minibatches
+#of batch_size), and training stops the way fit does: after max_iter epochs, or when the loss has not
+#improved by tol for more than n_iter_no_change epochs in a row. partial_fit would print "Iteration 1" on every
+#call, so a verbose classifier is made quiet and the epoch number and loss are printed here instead.
+#-----------------------------------------------------------------------------------------------------
+def fit_epochs(classifier, X, y, profiler=None, classes=None):
+    classes = np.unique(y) if classes is None else classes
+    best_loss = np.inf
+    no_improvement = 0
+    verbose = classifier.verbose
+    classifier.set_params(verbose=False)
+    for epoch in range(classifier.max_iter):
+        start = time.perf_counter()
+        classifier.partial_fit(X, y, classes=classes)
+        if verbose:
+            print("Epoch "+str(epoch + 1)+", loss = "+str("%.8f" % classifier.loss_))
+        if profiler is not None:
+            profiler.epoch(classifier.loss_, time.perf_counter() - start, len(y))
+        if classifier.loss_ > best_loss - classifier.tol:
+            no_improvement += 1
+        else:
+            no_improvement = 0
+        best_loss = min(best_loss, classifier.loss_)
+        if no_improvement > classifier.n_iter_no_change:
+            break
+    return classifier
+
+#Runs func(*args) under cProfile and writes the stats to prof_file (read them with python -m pstats prof_file).
+def profile_call(prof_file, func, *args):
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args)
+    finally:
+        profile.disable()
+        profile.dump_stats(prof_file)
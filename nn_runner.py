@@ -27,62 +27,21 @@
 # 4/27/2022                                                                                                                                            ###
 ##########################################################################################################################################################
 
-import sys, getopt
-import pandas as pd
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import confusion_matrix
+import sys, getopt, time
+from data_loader import load_table, peak_memory_mb
+
+msg_txt = """\n\nnn_runner.py -f <Tab delimited input file (e.g. saved from Excel)>\n\nAn Implementation of an MLPClassifier in Python.\n\nThis script takes any tab delimited file, where the first column contains the known categories, and the rest of the columns contain any numeric data to be used as input into the Multi-Layer Perceptron.\n\nAn MLPClassifier is an implementation of a Multi-Layer Perceptron Classifier, which is a feedforward artificial neural network that maps the input dataset to a set of output classes.\n\nThe confusion matrix helps you look at the errors in more detail. The column totals show the actual number of members for each group in the set, and the row totals show the group reported by the Perceptron.\n\nThe parsed input file is cached (see data_loader.py); --nocache parses it again.\n--dtype=type is the type the data is read into (default = float32), --engine=name is the parser, c (default) or pyarrow.\n\nSweep mode: -s <JSON spec file> trains one classifier per combination of the parameters in the spec, e.g.\n{"activation": ["relu", "tanh"], "hidden_layer_sizes": [[100], [150, 100, 50]], "max_iter": [200, 300]}\nThe candidates are trained in parallel (-j jobs, default = number of cores), -n N tries N random combinations instead of all of them, and the ranked results are written to -o <results file> (default = sweep_results.tsv).\n\nCross-validation mode: -k <folds> fits the classifier on k stratified folds in parallel (-j jobs) instead of one 80/20 split, and reports the accuracy and confusion matrix of each fold plus the totals. -r <repeats> repeats the k folds with different shuffles, --nostratify uses plain k-fold.\n\nModel files: --save=<model file> saves the trained classifier, its group names and column schema. --predict=<model file> skips training and classifies -f <file> -c <chunk size> rows at a time (default = 10000), writing the predicted group and the probability of each group for every row to -o <predictions file> (default = predictions.tsv). The first column of the file is copied to the output as the row name.\n\nStreaming mode: --stream trains on files too big for memory. The file is read -c <chunk size> rows at a time on every epoch (-e <epochs>, default = 10), about 20% of the rows are held out for testing (the same rows on every pass), and the training rows are shuffled in a buffer of --buffer=<chunks> chunks (default = 4) and passed to MLPClassifier.partial_fit. --save works in this mode too.\n\nProfiling: --profile=<file> records the time and peak memory of each stage (loading, encoding, splitting, fitting, predicting) and the loss, time and samples/sec of every epoch, and writes them to a .json file (or .csv, or tab delimited for any other name). In the normal mode the classifier is then trained one epoch at a time with partial_fit so the epochs can be timed. In the cross-validation, sweep and --pca-compare modes the whole mode is timed as one stage. --cprofile=<file> also writes a cProfile dump of the fit in the normal mode (python -m pstats <file> reads it).\n\nBudgeted training: --time=<seconds> (or e.g. 90m, 2h) stops training before that much wall-clock time has passed and --max-epochs=N after N epochs in total. --checkpoint=<file> saves the training state every --every=N epochs (default = 1) and when training stops, and a run started with the same checkpoint file carries on where the last one stopped. --validation=<fraction> holds that fraction of the training set out, keeps the weights with the best validation score and stops when it has not improved for --patience=N epochs (default = 10).\n\nMetrics: the precision, recall and F1 score of each group are printed with bootstrap 95% confidence intervals from --bootstrap=N resamples of the test set (default = 1000, 0 = no intervals).\n\nPCA stage: --pca=k standardizes the columns and projects them onto their top k principal components before training (fit on the training set only, see get_pca.py), which makes every epoch cheaper. --save saves the scaling and PCA with the classifier, so --predict takes the original columns. --pca-compare trains the classifier with and without the stage and reports the fit time, predict time and accuracy of both. The stage is not available in the cross-validation, sweep or streaming modes.\n\nJennifer Meneghin 4/27/2022\n\n"""
 
 def accuracy(confusion_matrix):
     diagonal_sum = confusion_matrix.trace()
     sum_of_all_elements = confusion_matrix.sum()
     return diagonal_sum/sum_of_all_elements
 
-def getDataFrame(argv):
-    msg_txt = """\n\nnn_runner.py -f <Tab delimited input file (e.g. saved from Excel)>\n\nAn Implementation of an MLPClassifier in Python.\n\nThis script takes any tab delimited file, where the first column contains the known categories, and the rest of the columns contain any numeric data to be used as input into the Multi-Layer Perceptron.\n\nAn MLPClassifier is an implementation of a Multi-Layer Perceptron Classifier, which is a feedforward artificial neural network that maps the input dataset to a set of output classes.\n\nThe confusion matrix helps you look at the errors in more detail. The column totals show the actual number of members for each group in the set, and the row totals show the group reported by the Perceptron.\n\nJennifer Meneghin 4/27/2022\n\n"""
-    in_file = "file.txt"
-    try:
-        opts, args = getopt.getopt(argv,"hf:",["ffile="])
-    except getopt.GetoptError:
-        print("\nNot a valid argument or value")
-        print(msg_txt)
-        sys.exit(2)        
-    for opt, arg in opts:
-        if opt == "-h":
-            print(msg_txt)
-            sys.exit()
-        elif opt in ("-f", "--ffile"):
-            in_file = arg
-    try:
-        fullDataSet = pd.read_csv(in_file, sep='\t')
-    except FileNotFoundError:
-        print("\nNot a valid argument or value -- File Not Found Error")
-        print(msg_txt)
-        sys.exit(3)                
-    return fullDataSet
-    
-def main(argv):
-    fullDataSet = getDataFrame(argv)
-
-    print("Importing data set...")
-    #This converts text data to numeric categories. Answer is in 1st column.
-    fullDataSet.iloc[:,0] = LabelEncoder().fit_transform(fullDataSet.iloc[:,0])
-
-    #If N = number of rows and test_size = 0.2 then 0.2xN = number of rows in test set. Rest are in training set.
-    #Rows chosen for test and training are randomized
-    print("Splitting data into training and testing sets...")
-    train_set, test_set = train_test_split(fullDataSet, test_size = 0.2, random_state = 21)
-
-    print("Splitting both training and testing data into X (input data) and Y (known answers)...")
-    X_train = train_set.iloc[:,1:].values
-    Y_train = train_set.iloc[:,0].values 
-    X_test = test_set.iloc[:,1:].values  
-    Y_test = test_set.iloc[:,0].values   
-
-    print("Running the MLP Classifier...")
-    #Multi-Layer Perceptron Classifier -- this is a feedforward artificial neural network that maps input data to a set of output classes.
-    classifier = MLPClassifier(                   
+#Multi-Layer Perceptron Classifier -- this is a feedforward artificial neural network that maps input data to a set of output classes.
+#Any of the parameters below can be overridden, e.g. build_classifier(activation='tanh') (this is what the sweep mode does).
+def build_classifier(**overrides):
+    from sklearn.neural_network import MLPClassifier
+    params = dict(
     activation='relu',     
     #activation='identity', #Possible Activation functions.
     #activation='logistic',
@@ -112,19 +71,330 @@ def main(argv):
     warm_start=False,
     learning_rate_init=.001
     )
+    params.update(overrides)
+    return MLPClassifier(**params)
+
+#Seconds, or minutes/hours with an m/h suffix (e.g. 90m).
+def parse_duration(text):
+    scale = {"s": 1, "m": 60, "h": 3600}
+    if text and text[-1] in scale:
+        return float(text[:-1]) * scale[text[-1]]
+    return float(text)
+
+def getOptions(argv):
+    options = {"in_file": "file.txt", "use_cache": True, "dtype": "float32", "engine": "c",
+               "sweep_file": "", "num_random": 0, "jobs": None, "out_file": "",
+               "save_file": "", "predict_file": "", "chunk_size": 10000,
+               "folds": 0, "repeats": 1, "stratified": True,
+               "stream": False, "epochs": 10, "buffer": 4,
+               "profile_file": "", "cprofile_file": "",
+               "max_epochs": 0, "time_budget": None, "checkpoint_file": "", "every": 1, "validation": 0.0, "patience": None,
+               "bootstrap": 1000, "pca": 0, "pca_compare": False}
+    try:
+        opts, args = getopt.getopt(argv,"hf:s:n:j:o:k:r:c:e:",["ffile=","nocache","dtype=","engine=","sweep=","random=","jobs=","ofile=","folds=","repeats=","nostratify","save=","predict=","chunksize=","stream","epochs=","buffer=","profile=","cprofile=","max-epochs=","time=","checkpoint=","every=","validation=","patience=","bootstrap=","pca=","pca-compare"])
+        for opt, arg in opts:
+            if opt == "-h":
+                print(msg_txt)
+                sys.exit()
+            elif opt in ("-f", "--ffile"):
+                options["in_file"] = arg
+            elif opt == "--nocache":
+                options["use_cache"] = False
+            elif opt == "--dtype":
+                options["dtype"] = arg
+            elif opt == "--engine":
+                options["engine"] = arg
+            elif opt in ("-s", "--sweep"):
+                options["sweep_file"] = arg
+            elif opt in ("-n", "--random"):
+                options["num_random"] = int(arg)
+            elif opt in ("-j", "--jobs"):
+                options["jobs"] = int(arg)
+            elif opt in ("-o", "--ofile"):
+                options["out_file"] = arg
+            elif opt in ("-k", "--folds"):
+                options["folds"] = int(arg)
+            elif opt in ("-r", "--repeats"):
+                options["repeats"] = int(arg)
+            elif opt == "--nostratify":
+                options["stratified"] = False
+            elif opt == "--save":
+                options["save_file"] = arg
+            elif opt == "--predict":
+                options["predict_file"] = arg
+            elif opt in ("-c", "--chunksize"):
+                options["chunk_size"] = int(arg)
+            elif opt == "--stream":
+                options["stream"] = True
+            elif opt in ("-e", "--epochs"):
+                options["epochs"] = int(arg)
+            elif opt == "--buffer":
+                options["buffer"] = int(arg)
+            elif opt == "--profile":
+                options["profile_file"] = arg
+            elif opt == "--cprofile":
+                options["cprofile_file"] = arg
+            elif opt == "--max-epochs":
+                options["max_epochs"] = int(arg)
+            elif opt == "--time":
+                options["time_budget"] = parse_duration(arg)
+            elif opt == "--checkpoint":
+                options["checkpoint_file"] = arg
+            elif opt == "--every":
+                options["every"] = int(arg)
+            elif opt == "--validation":
+                options["validation"] = float(arg)
+            elif opt == "--patience":
+                options["patience"] = int(arg)
+            elif opt == "--bootstrap":
+                options["bootstrap"] = int(arg)
+            elif opt == "--pca":
+                options["pca"] = int(arg)
+            elif opt == "--pca-compare":
+                options["pca_compare"] = True
+    except (getopt.GetoptError, ValueError):
+        print("\nNot a valid argument or value")
+        print(msg_txt)
+        sys.exit(2)        
+    if options["pca_compare"] and options["pca"] <= 0:
+        print("\n--pca-compare needs the number of components, e.g. --pca=20\n")
+        sys.exit(2)
+    if options["pca"] > 0 and (options["folds"] > 1 or options["sweep_file"] or options["stream"]):
+        print("\n--pca cannot be combined with -k, -s or --stream\n")
+        sys.exit(2)
+    if options["cprofile_file"] and (options["folds"] > 1 or options["sweep_file"] or options["stream"] or options["predict_file"] or options["pca_compare"]):
+        print("\n--cprofile only profiles the normal fit; it cannot be combined with -k, -s, --stream, --predict or --pca-compare\n")
+        sys.exit(2)
+    return options
+
+def getData(options):
+    try:
+        labels, data, columns = load_table(options["in_file"], options["use_cache"], dtype=options["dtype"], engine=options["engine"])   #parsed once, then read from the cache (see data_loader.py)
+    except FileNotFoundError:
+        print("\nNot a valid argument or value -- File Not Found Error")
+        print(msg_txt)
+        sys.exit(3)                
+    except ValueError:
+        print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+        sys.exit(4)
+    print("Peak memory after loading = "+str("%.1f" % peak_memory_mb())+" MB")
+    return labels, data, columns
+
+#Per-group precision, recall and F1 with bootstrap confidence intervals (see nn_metrics.py).
+def report_metrics(options, names, y_true, y_pred):
+    from nn_metrics import classification_metrics, bootstrap_metrics, print_report
+    metrics = classification_metrics(y_true, y_pred, len(names))
+    intervals = None
+    if options["bootstrap"] > 0:
+        intervals = bootstrap_metrics(y_true, y_pred, len(names), options["bootstrap"])
+    print_report(names, metrics, intervals)
+
+#Standardize and project onto the top k principal components, fit on the training rows only (see get_pca.py).
+def fit_pca_stage(options, X_train, X_test):
+    from get_pca import fit_scaled_pca
+    if options["pca"] > min(X_train.shape):
+        print("\n--pca="+str(options["pca"])+" is more components than the training set has columns ("+str(X_train.shape[1])+") or rows ("+str(X_train.shape[0])+")\n")
+        sys.exit(2)
+    start = time.time()
+    X_train_pcs, percents, scaler, pca = fit_scaled_pca(X_train, options["pca"], random_state=21)
+    X_test_pcs = pca.transform(scaler.transform(X_test))
+    print("PCA: "+str(options["pca"])+" components explain "+str("%.1f" % percents.sum())+"% of the variance (fit in "+str("%.2f" % (time.time() - start))+"s)")
+    return X_train_pcs, X_test_pcs, scaler, pca
+
+def run_pca_compare(options, X_train, X_test, Y_train, Y_test):
+    from sklearn.metrics import confusion_matrix
+    results = []
+    for name in ("Without PCA", "With PCA ("+str(options["pca"])+" components)"):
+        start = time.time()
+        if results:
+            X_train, X_test, scaler, pca = fit_pca_stage(options, X_train, X_test)
+        classifier = build_classifier(verbose=False)
+        classifier.fit(X_train, Y_train)
+        fit_time = time.time() - start
+        start = time.time()
+        y_prediction = classifier.predict(X_test)
+        predict_time = time.time() - start
+        results.append(fit_time)
+        print(name+": accuracy = "+str("%.4f" % accuracy(confusion_matrix(y_prediction, Y_test)))+", fit time = "+str("%.2f" % fit_time)+"s ("+str(classifier.n_iter_)+" epochs), predict time = "+str("%.3f" % predict_time)+"s")
+    print("Training with the PCA stage took "+str("%.2f" % (results[1] / results[0]))+" x the time (including fitting the PCA)")
+
+def run_sweep_mode(options, X_train, X_test, Y_train, Y_test):
+    from nn_parallel import read_spec, expand_grid, run_sweep, write_sweep_results, available_cores
+    try:
+        spec = read_spec(options["sweep_file"])
+    except (FileNotFoundError, ValueError):
+        print("\nThe sweep spec must be a JSON file mapping MLPClassifier parameters to lists of values.\n")
+        sys.exit(2)
+    candidates = expand_grid(spec, options["num_random"])
+    print("Training "+str(len(candidates))+" candidate classifiers on "+str(options["jobs"] or available_cores())+" cores...")
+    results = run_sweep(X_train, Y_train, X_test, Y_test, candidates, build_classifier, options["jobs"])
+    out_file = options["out_file"] or "sweep_results.tsv"
+    write_sweep_results(results, out_file)
+    for rank, result in enumerate(results[:10], 1):
+        print(str(rank)+". accuracy = "+str("%.4f" % result["accuracy"])+", fit time = "+str("%.2f" % result["fit_time"])+"s, iterations = "+str(result["n_iter"])+", "+str(result["params"]))
+    print("Ranked results written to "+out_file)
+
+def run_predict_mode(options):
+    from nn_model import load_model, predict_file
+    out_file = options["out_file"] or "predictions.tsv"
+    try:
+        model = load_model(options["predict_file"])
+        print("Classifying "+options["in_file"]+" with "+options["predict_file"]+"...")
+        rows = predict_file(model, options["in_file"], out_file, options["chunk_size"], options["engine"])
+    except FileNotFoundError as err:
+        print("\nNot a valid argument or value -- File Not Found Error: "+str(err.filename))
+        sys.exit(3)
+    except ValueError as err:
+        print("\n"+str(err)+"\n")
+        sys.exit(4)
+    print(str(rows)+" predictions written to "+out_file)
+
+def run_cv_mode(options, labels, data, answers):
+    from nn_parallel import run_cv
+    print("Running "+str(options["repeats"])+" x "+str(options["folds"])+"-fold cross-validation in parallel...")
+    cv = run_cv(data, answers, build_classifier, options["folds"], options["repeats"], options["stratified"], options["jobs"])
+    for result in cv["folds"]:
+        print("Repeat "+str(result["repeat"])+", fold "+str(result["fold"])+": accuracy = "+str("%.4f" % result["accuracy"])+", fit time = "+str("%.2f" % result["fit_time"])+"s")
+        print(result["cm"])
+    print("Total Confusion Matrix = ")
+    print(cv["cm"])
+    for name, acc, std in zip(labels.categories, cv["class_accuracy"], cv["class_accuracy_std"]):
+        print("Accuracy of "+str(name)+" = "+str("%.4f" % acc)+" +/- "+str("%.4f" % std))
+    print("Accuracy of MLPClassifier = "+str("%.4f" % cv["accuracy"])+" +/- "+str("%.4f" % cv["accuracy_std"]))
+
+#Out-of-core training: the file is never loaded as a whole (see nn_training.py).
+def run_stream_mode(options, profiler):
+    from nn_training import scan_classes, stream_train, stream_confusion_matrix
+    from data_loader import read_header
+    args = (options["chunk_size"], options["buffer"], options["dtype"], options["engine"])
     try:
-        classifier.fit(X_train,Y_train)
+        columns = read_header(options["in_file"])
+        classes = scan_classes(options["in_file"])
+        print("Training on "+options["in_file"]+" ("+str(len(classes))+" groups) in chunks of "+str(options["chunk_size"])+" rows...")
+        with profiler.stage("fit"):
+            classifier = stream_train(build_classifier(verbose=False), options["in_file"], classes, options["epochs"], *args, profiler=profiler)
+        with profiler.stage("predict"):
+            cm = stream_confusion_matrix(classifier, options["in_file"], classes, options["chunk_size"], options["dtype"], options["engine"])
+    except FileNotFoundError:
+        print("\nNot a valid argument or value -- File Not Found Error")
+        print(msg_txt)
+        sys.exit(3)
+    except ValueError:
+        print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+        sys.exit(4)
+    print("Confusion Matrix = ")
+    print(cm)
+    print("Accuracy of MLPClassifier = ", accuracy(cm))
+    from nn_metrics import labels_from_counts
+    report_metrics(options, classes, *labels_from_counts(cm))
+    print("Peak memory = "+str("%.1f" % peak_memory_mb())+" MB")
+    if options["save_file"]:
+        from nn_model import save_model
+        save_model(options["save_file"], classifier, classes, columns[1:], options["dtype"])
+        print("Model saved to "+options["save_file"])
+
+def write_profile(options, profiler):
+    if options["profile_file"]:
+        profiler.report()
+        profiler.write(options["profile_file"])
+        print("Profile written to "+options["profile_file"])
+
+#Fits the classifier: within a budget / with checkpoints if asked (see nn_training.py), otherwise one timed
+#epoch at a time when profiling, and under cProfile if asked. Returns the fitted classifier.
+def fit_classifier(options, classifier, X_train, Y_train, profiler):
+    from nn_profile import fit_epochs, profile_call
+    from sklearn.model_selection import train_test_split
+    if options["time_budget"] or options["max_epochs"] or options["checkpoint_file"] or options["validation"]:
+        from nn_training import fit_budget
+        X_val = Y_val = None
+        if options["validation"]:
+            X_train, X_val, Y_train, Y_val = train_test_split(X_train, Y_train, test_size = options["validation"], random_state = 21, stratify = Y_train)
+        fit = fit_budget
+        args = (classifier, X_train, Y_train, X_val, Y_val, options["max_epochs"], options["time_budget"], options["checkpoint_file"], options["every"], options["patience"], profiler)
+    elif options["profile_file"]:
+        fit, args = fit_epochs, (classifier, X_train, Y_train, profiler)
+    else:
+        fit, args = classifier.fit, (X_train, Y_train)
+    if options["cprofile_file"]:
+        return profile_call(options["cprofile_file"], fit, *args)
+    return fit(*args)
+
+def main(argv):
+    from nn_profile import Profiler
+    options = getOptions(argv)
+    profiler = Profiler()
+    if options["predict_file"]:
+        with profiler.stage("predict"):
+            run_predict_mode(options)
+        write_profile(options, profiler)
+        return
+    if options["stream"]:
+        run_stream_mode(options, profiler)
+        write_profile(options, profiler)
+        return
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import confusion_matrix
+    print("Importing data set...")
+    with profiler.stage("load"):
+        labels, data, columns = getData(options)
+    #This converts text data to numeric categories. Answer is in 1st column.
+    #(The categories are sorted, so these are the same numbers LabelEncoder().fit_transform would give.)
+    with profiler.stage("encode"):
+        answers = labels.codes
+
+    if options["folds"] > 1:
+        with profiler.stage("cv"):
+            run_cv_mode(options, labels, data, answers)
+        write_profile(options, profiler)
+        return
+
+    #If N = number of rows and test_size = 0.2 then 0.2xN = number of rows in test set. Rest are in training set.
+    #Rows chosen for test and training are randomized
+    #X = input data, Y = known answers
+    print("Splitting data into training and testing sets...")
+    with profiler.stage("split"):
+        X_train, X_test, Y_train, Y_test = train_test_split(data, answers, test_size = 0.2, random_state = 21)
+
+    if options["sweep_file"]:
+        with profiler.stage("sweep"):
+            run_sweep_mode(options, X_train, X_test, Y_train, Y_test)
+        write_profile(options, profiler)
+        return
+    if options["pca_compare"]:
+        with profiler.stage("compare"):
+            run_pca_compare(options, X_train, X_test, Y_train, Y_test)
+        write_profile(options, profiler)
+        return
+    if options["pca"]:
+        with profiler.stage("pca"):
+            X_train, X_test, scaler, pca = fit_pca_stage(options, X_train, X_test)
+
+    print("Running the MLP Classifier...")
+    classifier = build_classifier()
+    try:
+        with profiler.stage("fit"):
+            classifier = fit_classifier(options, classifier, X_train, Y_train, profiler)
     except ValueError:
         print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
         sys.exit(4)                
 
-    y_prediction = classifier.predict(X_test)
+    with profiler.stage("predict"):
+        y_prediction = classifier.predict(X_test)
     cm = confusion_matrix(y_prediction, Y_test)
     print("Confusion Matrix = ")
     print(cm)
     print("Calculating the accuracy of the MLP Classifier...")
     print("Accuracy of MLPClassifier = ", accuracy(cm))
+    report_metrics(options, labels.categories, Y_test, y_prediction)
+
+    if options["save_file"]:
+        from nn_model import save_model
+        if options["pca"]:
+            from sklearn.pipeline import Pipeline
+            classifier = Pipeline([("scale", scaler), ("pca", pca), ("mlp", classifier)])
+        save_model(options["save_file"], classifier, labels.categories, columns[1:], options["dtype"])
+        print("Model saved to "+options["save_file"])
+    write_profile(options, profiler)
     
 if __name__ == "__main__":
     main(sys.argv[1:])
-
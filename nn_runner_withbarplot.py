@@ -27,26 +27,25 @@
 # 4/27/2022                                                                                                                                            ###
 ##########################################################################################################################################################
 
-import sys, getopt
-import pandas as pd
-import seaborn as sns
+import sys, getopt, json
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import confusion_matrix
+from data_loader import load_table, peak_memory_mb
+from nn_metrics import encode, classification_metrics, bootstrap_metrics, print_report
 
 def accuracy(confusion_matrix):
     diagonal_sum = confusion_matrix.trace()
     sum_of_all_elements = confusion_matrix.sum()
     return diagonal_sum/sum_of_all_elements
 
-def getDataFrame(argv):
-    msg_txt = """\n\nnn_runner.py -f <Tab delimited input file (e.g. saved from Excel)>\n\nAn Implementation of an MLPClassifier in Python.\n\nThis script takes any tab delimited file, where the first column contains the known categories, and the rest of the columns contain any numeric data to be used as input into the Multi-Layer Perceptron.\n\nAn MLPClassifier is an implementation of a Multi-Layer Perceptron Classifier, which is a feedforward artificial neural network that maps the input dataset to a set of output classes.\n\nThe confusion matrix helps you look at the errors in more detail. The column totals show the actual number of members for each group in the set, and the row totals show the group reported by the Perceptron.\n\nJennifer Meneghin 4/27/2022\n\n"""
+def getData(argv):
+    msg_txt = """\n\nnn_runner.py -f <Tab delimited input file (e.g. saved from Excel)>\n\nAn Implementation of an MLPClassifier in Python.\n\nThis script takes any tab delimited file, where the first column contains the known categories, and the rest of the columns contain any numeric data to be used as input into the Multi-Layer Perceptron.\n\nAn MLPClassifier is an implementation of a Multi-Layer Perceptron Classifier, which is a feedforward artificial neural network that maps the input dataset to a set of output classes.\n\nThe confusion matrix helps you look at the errors in more detail. The column totals show the actual number of members for each group in the set, and the row totals show the group reported by the Perceptron.\n\nThe parsed input file is cached (see data_loader.py); --nocache parses it again.\n--dtype=type is the type the data is read into (default = float32), --engine=name is the parser, c (default) or pyarrow.\n--no-plot skips the bar plot (and matplotlib and seaborn) and writes the results to the screen as JSON; all other messages go to stderr.\n\nJennifer Meneghin 4/27/2022\n\n"""
     in_file = "file.txt"
+    use_cache = True
+    dtype = 'float32'
+    engine = 'c'
+    plot = True
     try:
-        opts, args = getopt.getopt(argv,"hf:",["ffile="])
+        opts, args = getopt.getopt(argv,"hf:",["ffile=","nocache","dtype=","engine=","no-plot"])
     except getopt.GetoptError:
         print("\nNot a valid argument or value")
         print(msg_txt)
@@ -57,27 +56,40 @@ def getDataFrame(argv):
             sys.exit()
         elif opt in ("-f", "--ffile"):
             in_file = arg
+        elif opt == "--nocache":
+            use_cache = False
+        elif opt == "--dtype":
+            dtype = arg
+        elif opt == "--engine":
+            engine = arg
+        elif opt == "--no-plot":
+            plot = False
+    if not plot:
+        sys.stdout = sys.stderr                            #messages to stderr, only the JSON results to stdout
     try:
-        fullDataSet = pd.read_csv(in_file, sep='\t')
+        labels, data, columns = load_table(in_file, use_cache, dtype=dtype, engine=engine)   #parsed once, then read from the cache (see data_loader.py)
     except FileNotFoundError:
         print("\nNot a valid argument or value -- File Not Found Error")
         print(msg_txt)
         sys.exit(3)                
-    return fullDataSet
+    except ValueError:
+        print("\nNon-numeric value found in datafile. Please fix your data and try again.\n")
+        sys.exit(4)
+    print("Peak memory after loading = "+str("%.1f" % peak_memory_mb())+" MB")
+    return labels, data, plot
     
 def main(argv):
-    fullDataSet = getDataFrame(argv)
+    results_out = sys.stdout
+    labels, data, plot = getData(argv)
+    from sklearn.model_selection import train_test_split
+    from sklearn.neural_network import MLPClassifier
+    from sklearn.metrics import confusion_matrix
 
     #If N = number of rows and test_size = 0.2 then 0.2xN = number of rows in test set. Rest are in training set.
     #Rows chosen for test and training are randomized
+    #X = input data, Y = known answers
     print("Splitting data into training and testing sets...")
-    train_set, test_set = train_test_split(fullDataSet, test_size = 0.2, random_state = 21)
-
-    print("Splitting both training and testing data into X (input data) and Y (known answers)...")
-    X_train = train_set.iloc[:,1:].values
-    Y_train = train_set.iloc[:,0].values 
-    X_test = test_set.iloc[:,1:].values  
-    Y_test = test_set.iloc[:,0].values   
+    X_train, X_test, Y_train, Y_test = train_test_split(data, np.asarray(labels), test_size = 0.2, random_state = 21)
 
     print("Running the MLP Classifier...")
     #Multi-Layer Perceptron Classifier -- this is a feedforward artificial neural network that maps input data to a set of output classes.
@@ -119,7 +131,7 @@ def main(argv):
 
     y_prediction = classifier.predict(X_test)
     cm = confusion_matrix(y_prediction, Y_test)
-    labels = np.unique(Y_test)
+    labels = np.unique(np.concatenate((Y_test, y_prediction)))
     print("Labels = ")
     print(labels)
 
@@ -130,12 +142,25 @@ def main(argv):
     print("Accuracy of MLPClassifier = ", acc)
 
     
-    sum0 = np.sum(cm, axis=0)            #column totals
-    r = cm/sum0                          #divide matrix values by column totals
-    print(r)
-    d = np.diag(r)                       #diagonal of matrix is correct values, so now accuracy (correct values / total values = accuracy)
-    d = np.append(d,acc)                 #add overall accuracy to list of category accuracies
-    d = d*100                            #to get percentage
+    y_true = encode(Y_test, labels)      #group names -> numbers for the metrics
+    y_pred = encode(y_prediction, labels)
+    metrics = classification_metrics(y_true, y_pred, len(labels))
+    intervals = bootstrap_metrics(y_true, y_pred, len(labels))
+    print_report(labels, metrics, intervals)
+    d = np.append(metrics["recall"],acc) #recall = correct values / column total = accuracy of each category, then add overall accuracy
+    low = np.append(intervals["recall"][0], intervals["accuracy"][0])
+    high = np.append(intervals["recall"][1], intervals["accuracy"][1])
+    d, low, high = d*100, low*100, high*100   #to get percentage
+    if not plot:
+        groups = {str(name): {metric: float(metrics[metric][n]) for metric in ("precision", "recall", "f1")} for n, name in enumerate(labels)}
+        for n, name in enumerate(labels):
+            groups[str(name)]["recall_ci"] = [float(intervals["recall"][0][n]), float(intervals["recall"][1][n])]
+        print(json.dumps({"accuracy": float(acc), "accuracy_ci": [float(intervals["accuracy"][0]), float(intervals["accuracy"][1])],
+                          "groups": groups, "confusion_matrix": cm.tolist()}), file=results_out)
+        return
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
     mydf = pd.DataFrame(d)               #convert to dataframe for bar plot
     mydf.columns = ["% Accuracy"]        #add column label to accuracy column
     labels = np.append(labels,'Overall') #add overall text to category labels
@@ -143,6 +168,7 @@ def main(argv):
     print("mydf = "+str(mydf))
     sns.set()
     ax = sns.barplot(data=mydf, x='Category', y='% Accuracy')
+    ax.errorbar(np.arange(len(d)), d, yerr=[d-low, high-d], fmt='none', ecolor='black', capsize=4)   #bootstrap 95% confidence intervals
     plt.show()
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+##########################################################################################
+### Out-of-core training for nn_runner.py                                              ###
+###                                                                                    ###
+### The input file is read a chunk at a time on every epoch and never held in memory   ###
+### as a whole. Each row is assigned to the training or the test set by a random draw ###
+### seeded with its chunk number, so every pass over the file makes the same split.    ###
+### Training rows go through a shuffle buffer of a few chunks and are fed to          ###
+### MLPClassifier.partial_fit; the test rows are only used for the confusion matrix.   ###
+##########################################################################################
+
+import os, time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import confusion_matrix
+from data_loader import read_header, iter_table, atomic_write
+
+#Group names in the same order load_table gives them (numbers sorted as numbers), read from the label column only.
+def scan_classes(in_file, chunk_size=100000):
+    columns = read_header(in_file)
+    names = set()
+    for chunk in pd.read_csv(in_file, sep='\t', usecols=[0], dtype={columns[0]: str}, chunksize=chunk_size):
+        names.update(chunk.iloc[:, 0].unique())
+    try:
+        return sorted(names, key=float)
+    except ValueError:
+        return sorted(names)
+
+def test_rows(chunk_number, num_rows, test_size, seed):
+    return np.random.default_rng([seed, chunk_number]).random(num_rows) < test_size
+
+#Yields (X, y) for the training or the test rows of each chunk, with y as numbers 0..len(classes)-1.
+def iter_split(in_file, classes, test, chunk_size=10000, dtype=np.float32, engine='c', test_size=0.2, seed=21):
+    for chunk_number, (labels, data, _) in enumerate(iter_table(in_file, chunk_size, dtype, engine)):
+        answers = pd.Categorical(np.asarray(labels, dtype=str), categories=classes).codes
+        rows = test_rows(chunk_number, len(data), test_size, seed)
+        if not test:
+            rows = ~rows
+        yield data[rows], answers[rows]
+
+#-----------------------------------------------------------------------------------------------------
+#Training rows are collected into a buffer of buffer_chunks chunks, shuffled, and handed to partial_fit
+#(which runs through them in minibatches of the classifier's batch_size) once the buffer is full.
+#-----------------------------------------------------------------------------------------------------
+def iter_shuffled(batches, buffer_rows, rng):
+    X_parts, y_parts, count = [], [], 0
+    for X, y in batches:
+        X_parts.append(X)
+        y_parts.append(y)
+        count += len(y)
+        if count >= buffer_rows:
+            X_all, y_all = np.concatenate(X_parts), np.concatenate(y_parts)
+            order = rng.permutation(len(y_all))
+            yield X_all[order], y_all[order]
+            X_parts, y_parts, count = [], [], 0
+    if count:
+        X_all, y_all = np.concatenate(X_parts), np.concatenate(y_parts)
+        order = rng.permutation(len(y_all))
+        yield X_all[order], y_all[order]
+
+def train_epoch(classifier, in_file, classes, epoch, chunk_size=10000, buffer_chunks=4, dtype=np.float32, engine='c', test_size=0.2, seed=21):
+    rng = np.random.default_rng([seed, epoch])
+    batches = iter_split(in_file, classes, False, chunk_size, dtype, engine, test_size, seed)
+    total_loss = 0.0
+    rows = 0
+    for X, y in iter_shuffled(batches, buffer_chunks * chunk_size, rng):
+        classifier.partial_fit(X, y, classes=np.arange(len(classes)))
+        total_loss += classifier.loss_ * len(y)
+        rows += len(y)
+    return total_loss / max(rows, 1), rows
+
+def stream_train(classifier, in_file, classes, epochs=10, chunk_size=10000, buffer_chunks=4, dtype=np.float32, engine='c', test_size=0.2, seed=21, profiler=None):
+    for epoch in range(epochs):
+        start = time.time()
+        loss, rows = train_epoch(classifier, in_file, classes, epoch, chunk_size, buffer_chunks, dtype, engine, test_size, seed)
+        seconds = time.time() - start
+        print("Epoch "+str(epoch + 1)+", loss = "+str("%.8f" % loss)+", "+str(rows)+" rows in "+str("%.2f" % seconds)+" seconds")
+        if profiler is not None:
+            profiler.epoch(loss, seconds, rows)
+    return classifier
+
+#Confusion matrix over the held out rows (rows = predicted group, columns = actual group, like nn_runner.py).
+def stream_confusion_matrix(classifier, in_file, classes, chunk_size=10000, dtype=np.float32, engine='c', test_size=0.2, seed=21):
+    cm = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    for X, y in iter_split(in_file, classes, True, chunk_size, dtype, engine, test_size, seed):
+        if len(y):
+            cm += confusion_matrix(classifier.predict(X), y, labels=np.arange(len(classes)))
+    return cm
+
+#-----------------------------------------------------------------------------------------------------
+#Training in bounded time slices. fit_budget trains one epoch at a time until max_epochs (counted over all
+#the runs) or until max_seconds have passed in this run, and writes a checkpoint every `every` epochs and
+#when it stops. If the checkpoint file exists, training resumes from it. Given a validation set, it keeps
+#the weights with the best validation score and stops when that has not improved by tol for `patience`
+#epochs; the best weights are put back at the end. Without one, it stops the way MLPClassifier.fit does.
+#Like fit_epochs, a verbose classifier is made quiet and the epoch numbers and losses are printed here.
+#-----------------------------------------------------------------------------------------------------
+def save_training_checkpoint(file_name, state):
+    atomic_write(file_name, lambda tmp_file: joblib.dump(state, tmp_file))
+
+def load_training_checkpoint(file_name, num_features, classes):
+    state = joblib.load(file_name)
+    classifier = state["classifier"]
+    if classifier.n_features_in_ != num_features or not np.array_equal(classifier.classes_, classes):
+        raise ValueError(file_name+" was trained on a different data set")
+    return state
+
+def copy_weights(classifier):
+    return [c.copy() for c in classifier.coefs_], [i.copy() for i in classifier.intercepts_]
+
+def fit_budget(classifier, X, y, X_val=None, y_val=None, max_epochs=None, max_seconds=None, checkpoint_file="", every=1, patience=None, profiler=None):
+    classes = np.unique(y)
+    max_epochs = max_epochs or classifier.max_iter
+    patience = classifier.n_iter_no_change if patience is None else patience
+    verbose = classifier.verbose
+    state = {"classifier": classifier, "epoch": 0, "best_score": -np.inf, "best_weights": None, "no_improvement": 0, "done": False}
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        state = load_training_checkpoint(checkpoint_file, X.shape[1], classes)
+        classifier = state["classifier"]
+        print("Resuming from "+checkpoint_file+" after epoch "+str(state["epoch"]))
+    classifier.set_params(verbose=False)
+    start = time.time()
+    last_epoch = 0.0
+    stopped = "no improvement for "+str(patience)+" epochs" if state["done"] else str(max_epochs)+" epochs"
+    while state["epoch"] < max_epochs and not state["done"]:
+        if max_seconds is not None and time.time() - start + last_epoch > max_seconds:
+            stopped = "time budget"
+            break
+        epoch_start = time.time()
+        classifier.partial_fit(X, y, classes=classes)
+        last_epoch = time.time() - epoch_start
+        state["epoch"] += 1
+        if profiler is not None:
+            profiler.epoch(classifier.loss_, last_epoch, len(y))
+        score = classifier.score(X_val, y_val) if X_val is not None else -classifier.loss_
+        if score > state["best_score"] + classifier.tol:
+            state["no_improvement"] = 0
+        else:
+            state["no_improvement"] += 1
+        if score > state["best_score"]:
+            state["best_score"] = score
+            if X_val is not None:
+                state["best_weights"] = copy_weights(classifier)
+        if verbose:
+            line = "Epoch "+str(state["epoch"])+", loss = "+str("%.8f" % classifier.loss_)
+            print(line+", validation score = "+str("%.4f" % score) if X_val is not None else line)
+        if state["no_improvement"] > patience:
+            state["done"] = True
+            stopped = "no improvement for "+str(patience)+" epochs"
+        if checkpoint_file and (state["epoch"] % every == 0 or state["done"]):
+            save_training_checkpoint(checkpoint_file, state)
+    if checkpoint_file and not state["done"]:
+        save_training_checkpoint(checkpoint_file, state)
+    if state["best_weights"] is not None:
+        classifier.coefs_ = [c.copy() for c in state["best_weights"][0]]
+        classifier.intercepts_ = [i.copy() for i in state["best_weights"][1]]
+    print("Stopped after epoch "+str(state["epoch"])+" ("+stopped+")")
+    return classifier
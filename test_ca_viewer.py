@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+###########################################################################
+### Tests for ca_viewer.py (run with python -m pytest)                  ###
+###                                                                     ###
+### Every engine is checked against the original string version,       ###
+### run_2DCA, on seeded random rules and ICs. Widths 63, 64, 65 and 129 ###
+### cover the edge cells the packed engine recomputes when the width is ###
+### not a multiple of 64.                                               ###
+###########################################################################
+
+import numpy as np
+import pytest
+import ca_viewer
+
+WIDTHS = [7, 31, 63, 64, 65, 129]
+RULE_BITS = [8, 32, 128]
+NUM_GENS = 60
+
+#run_2DCA only does radius 3 (128 bit rules); this is the same string algorithm for any radius.
+def reference_ca(ca_string, input_string, num_gens):
+    radius = ca_viewer.rule_radius(len(ca_string))
+    total_results = [[int(i) for i in input_string]]
+    current_string = input_string
+    for i in range(1, num_gens):
+        padded = current_string[-radius:] + current_string + current_string[:radius]
+        current_string = "".join(ca_string[int(padded[j:j + 2*radius + 1], 2)] for j in range(len(current_string)))
+        total_results.append([int(i) for i in current_string])
+    return np.array(total_results, dtype=np.uint8)
+
+#Rules drawn like the ICs (a random density, then each bit on with that probability), so some settle quickly
+#into fixed points and short cycles and the cycle detection paths are exercised too.
+def random_rules(num_rules, num_bits, seed):
+    return ca_viewer.random_ics(num_rules, num_bits, seed)
+
+def cases(num_bits, width, seed, num_cases=4):
+    rules = random_rules(num_cases, num_bits, seed)
+    ics = ca_viewer.random_ics(num_cases, width, seed + 1)
+    return [(ca_viewer.as_bits(rule), ca_viewer.as_bits(ic)) for rule, ic in zip(rules, ics)]
+
+def bit_string(bits):
+    return "".join(map(str, bits))
+
+def test_reference_matches_run_2DCA():
+    for width in WIDTHS:
+        for rule, ic in cases(128, width, width):
+            expected = np.array(ca_viewer.run_2DCA(bit_string(rule), bit_string(ic), NUM_GENS), dtype=np.uint8)
+            assert np.array_equal(reference_ca(bit_string(rule), bit_string(ic), NUM_GENS), expected)
+
+@pytest.mark.parametrize("num_bits", RULE_BITS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_run_ca(num_bits, width):
+    for rule, ic in cases(num_bits, width, 1000 * num_bits + width):
+        expected = reference_ca(bit_string(rule), bit_string(ic), NUM_GENS)
+        assert np.array_equal(ca_viewer.run_ca(bit_string(rule), bit_string(ic), NUM_GENS), expected)
+
+@pytest.mark.parametrize("num_bits", RULE_BITS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_run_ca_packed(num_bits, width):
+    for rule, ic in cases(num_bits, width, 2000 * num_bits + width):
+        expected = reference_ca(bit_string(rule), bit_string(ic), NUM_GENS)
+        words = ca_viewer.run_ca(bit_string(rule), bit_string(ic), NUM_GENS, packed=True)
+        assert np.array_equal(ca_viewer.unpack_lattice(words, width), expected)
+
+@pytest.mark.parametrize("packed", [False, True])
+@pytest.mark.parametrize("num_bits", RULE_BITS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_run_ca_cycles(num_bits, width, packed):
+    for rule, ic in cases(num_bits, width, 3000 * num_bits + width):
+        expected = reference_ca(bit_string(rule), bit_string(ic), NUM_GENS)
+        results, transient, period = ca_viewer.run_ca_cycles(bit_string(rule), bit_string(ic), NUM_GENS, packed=packed, fill=True)
+        if packed:
+            results = ca_viewer.unpack_lattice(results, width)
+        assert np.array_equal(results, expected)
+        if transient is not None:
+            assert np.array_equal(expected[transient], expected[transient + period])
+
+@pytest.mark.parametrize("num_bits", RULE_BITS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_run_batch_cycles(num_bits, width):
+    rules = random_rules(3, num_bits, 4000 * num_bits + width)
+    ics = ca_viewer.random_ics(5, width, 4000 * num_bits + width + 1)
+    for window in (0, 4, 16):
+        finals, transient, period = ca_viewer.run_batch_cycles(rules, ics, NUM_GENS, window=window)
+        for r, rule in enumerate(rules):
+            for k, ic in enumerate(ics):
+                expected = reference_ca(bit_string(rule), bit_string(ic), NUM_GENS)
+                assert np.array_equal(finals[r, k], expected[-1])
+                if transient[r, k] >= 0:
+                    assert np.array_equal(expected[transient[r, k]], expected[transient[r, k] + period[r, k]])
@@ -0,0 +1,13 @@
+#!/usr/bin/python3
+###########################################################################
+### Import time budgets (run with python -m pytest)                     ###
+###                                                                     ###
+### Each script is imported in a fresh interpreter and must load within ###
+### its budget in benchmark.IMPORT_BUDGETS without pulling in pandas,   ###
+### matplotlib, seaborn, sklearn or scipy (benchmark.py -I by hand).    ###
+###########################################################################
+
+import benchmark
+
+def test_import_budgets():
+    assert benchmark.check_imports() == []